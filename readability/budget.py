@@ -0,0 +1,106 @@
+"""Bound the work of extracting and munging one page.
+
+Markup longer than EXTRACT_MAX_CHARS is cut to that length before parsing
+('truncated' mode).  A tree of more than EXTRACT_MAX_NODES tags, or one still
+being scored EXTRACT_MAX_SECONDS after extraction began, gets a cheap text
+density pick instead of scoring ('density' mode), or the content of the page's
+feed entry, if it had some but it was rejected ('feed' mode).  Munging past
+the deadline skips, or cuts short, its optional stages ('munge_partial').
+
+The modes a page goes through are noted in its timings and logged, and each
+switch is counted in the `extract_mode_total` metric.  A limit of 0 is none.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import contextvars
+import time
+
+from readability import metrics
+from readability import settings
+from readability import timing
+from readability import util
+
+
+_CURRENT = contextvars.ContextVar('budget', default=None)
+
+
+class OverBudgetError(Exception):
+  pass
+
+
+class Budget(object):
+  """The time limit on one page's work, and how it was cut short, if it was."""
+
+  def __init__(self):
+    self.deadline = None
+    self.mode = 'full'
+    self.modes = []
+    self.reason = None
+    # (soup, tag) of feed entry content that was rejected, as a last resort.
+    self.fallback = None
+
+  def Start(self):
+    """Start the clock, unless already started."""
+    if self.deadline is None and settings.EXTRACT_MAX_SECONDS:
+      self.deadline = time.monotonic() + settings.EXTRACT_MAX_SECONDS
+
+  def Spent(self):
+    return self.deadline is not None and time.monotonic() > self.deadline
+
+  def Degrade(self, mode, reason, url):
+    """Record a switch to a cheaper mode, because of the `reason` limit."""
+    if mode == self.mode:
+      return
+    self.mode = mode
+    self.modes.append(mode)
+    self.reason = reason
+    timing.Note('extract_mode', '+'.join(self.modes))
+    metrics.Inc('extract_mode_total', (mode, reason))
+    util.log.warning('Over %s budget for %s; using %s mode', reason, url, mode)
+
+
+@contextlib.contextmanager
+def Limit():
+  """Bound the work within; joins an enclosing budget if any."""
+  budget = _CURRENT.get()
+  if budget is not None:
+    yield budget
+    return
+  budget = Budget()
+  token = _CURRENT.set(budget)
+  try:
+    yield budget
+  finally:
+    _CURRENT.reset(token)
+
+
+def Check():
+  """Raise `OverBudgetError` if the current budget's time is up."""
+  budget = _CURRENT.get()
+  if budget is not None and budget.Spent():
+    raise OverBudgetError()
+
+
+def SetFallback(soup, tag):
+  """Offer content to use if extraction goes over budget."""
+  budget = _CURRENT.get()
+  if budget is not None:
+    budget.fallback = (soup, tag)
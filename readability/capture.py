@@ -0,0 +1,113 @@
+"""Keep the inputs of slow or failed cleans, to replay them offline.
+
+With the CAPTURE_DIR setting set, a clean which fails, or takes longer than
+CAPTURE_SLOW_SECONDS, has its fetched response saved there: the raw body,
+headers, status, final URL and encoding, plus the stage timings.  Only the
+newest CAPTURE_MAX_COUNT are kept.  Each is a `replay_origin` recording
+directory, so `manage.py replay_capture` can re-run its extraction, and the
+replay origin can serve it.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import contextvars
+import os
+import pathlib
+import re
+import shutil
+import time
+import urllib.parse
+
+from readability import replay_origin
+from readability import settings
+from readability import util
+
+
+_CURRENT = contextvars.ContextVar('capture', default=None)
+
+
+@contextlib.contextmanager
+def Capturing():
+  """Within, remember the response fetched for one clean, if capture is on.
+
+  Yields a dict for `Response()` to fill, or None if capture is off.
+  """
+  if not settings.CAPTURE_DIR:
+    yield None
+    return
+  captured = {}
+  token = _CURRENT.set(captured)
+  try:
+    yield captured
+  finally:
+    _CURRENT.reset(token)
+
+
+def Response(response, final_url):
+  """Remember a fetched response, within `Capturing()`."""
+  captured = _CURRENT.get()
+  if captured is not None:
+    captured['response'] = response
+    captured['final_url'] = final_url
+
+
+def MaybeSave(url, captured, timings, error=None):
+  """Save the captured response if the clean failed or was slow."""
+  if not captured or 'response' not in captured:
+    return
+  seconds = timings.stages.get('clean', (0, 0.0))[1]
+  if error is None and seconds < settings.CAPTURE_SLOW_SECONDS:
+    return
+  try:
+    _Save(url, captured, timings, error, seconds)
+  except OSError:
+    util.log.exception('Could not capture clean of %s', url)
+
+
+def _Save(url, captured, timings, error, seconds):
+  response = captured['response']
+  capture_dir = pathlib.Path(settings.CAPTURE_DIR)
+  capture_dir.mkdir(parents=True, exist_ok=True)
+  host = re.sub(r'[^\w.-]', '_', urllib.parse.urlparse(url).hostname or '')
+  name = '%d-%d-%s' % (time.time() * 1000, os.getpid(), host)
+
+  # Write to a temporary name and rename, so that a partial capture never
+  # looks complete.
+  temp_dir = capture_dir / ('.' + name)
+  replay_origin.SaveRecording(
+      temp_dir, url,
+      replay_origin.Recording(
+          response.status_code, list(response.headers.items()),
+          response.content),
+      final_url=captured['final_url'],
+      encoding=response.encoding,
+      seconds=seconds,
+      error='%s: %s' % (error.__class__.__name__, error) if error else None,
+      timings=timings.AsDict(),
+      captured_at=time.time())
+  os.rename(temp_dir, capture_dir / name)
+  util.log.info('Captured clean of %s as %s', url, name)
+
+  # Captures are named by time, so the first sort oldest; drop the excess.
+  captures = sorted(
+      path for path in capture_dir.iterdir() if not path.name.startswith('.'))
+  excess = max(len(captures) - settings.CAPTURE_MAX_COUNT, 0)
+  for path in captures[:excess]:
+    shutil.rmtree(path, ignore_errors=True)
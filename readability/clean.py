@@ -23,21 +23,43 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import asyncio
 import base64
+import collections
+import concurrent.futures
+import contextlib
+import functools
 import re
 import urllib.parse
 
 import bs4
+from django import db
 import hyphenate
 import requests
 
+from readability import budget
+from readability import capture
 from readability import extract_content
 from readability import extract_feed
+from readability import metrics
+from readability import redirects
 from readability import settings
+from readability import sites
+from readability import timing
 from readability import util
 
 
 _MAX_URL_DISPLAY_LEN = 60
+# Pages `CleanManyAsync()` cleans at once from any one host.
+_BATCH_HOST_CONCURRENCY = 4
+_REDIRECT_CACHE = redirects.RedirectCache()
+
+# Stages of `CleanAsync()`.  Network-bound ones mostly wait on sockets, so many
+# can run at once; CPU-bound ones only contend past one thread per core.
+_FETCH_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    settings.FETCH_THREADS, thread_name_prefix='fetch')
+_EXTRACT_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    settings.EXTRACT_THREADS, thread_name_prefix='extract')
 
 RE_ALIGNED = re.compile(
     r'(?:_|\b)(?:align|float:\s*)?(left|right)(?:_|\b)', re.I)
@@ -69,6 +91,13 @@ if not settings.DEBUG:
       'score': settings.DEBUG,
       })
 
+# For `_MungeStripEmpties()`: bits of what a tag holds.  Any text; text of the
+# string types `Tag.text` includes for most tags; a tag other than <br>, <hr>.
+_HOLDS_TEXT = 1
+_HOLDS_PLAIN_TEXT = 2
+_HOLDS_TAG = 4
+_PLAIN_STRING_TYPES = (bs4.NavigableString, bs4.CData)
+
 
 def _BestEncoding(response):
   m = re.search(
@@ -81,7 +110,68 @@ def _BestEncoding(response):
 
 
 def Clean(url):
-  url, html = _Clean(url)
+  with _Measure(url):
+    final_url, html = _Clean(url)
+  return _WithSourceLink(final_url, html)
+
+
+async def CleanAsync(url, feed_cache=None):
+  """As `Clean()`, but await each blocking stage in a thread pool."""
+  with _Measure(url):
+    final_url, html = await _CleanAsync(url, feed_cache=feed_cache)
+  return _WithSourceLink(final_url, html)
+
+
+async def CleanManyAsync(urls):
+  """Clean many URLs concurrently, sharing work between them.
+
+  URLs which normalize to the same one are cleaned once, feeds are downloaded
+  once per batch, and at most `_BATCH_HOST_CONCURRENCY` pages are cleaned from
+  any one host at a time.
+
+  Yields:
+    Tuples of (list of the given URLs, HTML as from `Clean()` or None,
+    exception or None), as each finishes.
+  """
+  urls_by_key = collections.OrderedDict()
+  for url in urls:
+    urls_by_key.setdefault(NormalizeUrl(url), []).append(url)
+  feed_cache = extract_feed.FeedCache()
+  host_semaphores = collections.defaultdict(
+      lambda: asyncio.Semaphore(_BATCH_HOST_CONCURRENCY))
+
+  async def CleanOne(key):
+    async with host_semaphores[urllib.parse.urlparse(key).hostname]:
+      try:
+        return key, await CleanAsync(key, feed_cache=feed_cache), None
+      except Exception as e:
+        return key, None, e
+
+  for future in asyncio.as_completed([CleanOne(key) for key in urls_by_key]):
+    key, html, error = await future
+    yield urls_by_key[key], html, error
+
+
+@contextlib.contextmanager
+def _Measure(url):
+  """Time the clean within, then log and count it, and capture it if slow."""
+  with timing.Collect() as timings, capture.Capturing() as captured:
+    try:
+      with budget.Limit(), timing.Stage('clean'):
+        yield
+    except Exception as e:
+      metrics.Inc('clean_total', (
+          'error:' + e.__class__.__name__, timings.notes.get('path', '')))
+      capture.MaybeSave(url, captured, timings, e)
+      raise
+    capture.MaybeSave(url, captured, timings)
+  metrics.Inc('clean_total', ('ok', timings.notes.get('path', '')))
+  metrics.ObserveTimings(timings)
+  util.log.info(
+      'Cleaned %s: %s', url, timings, extra={'timings': timings.AsDict()})
+
+
+def _WithSourceLink(url, html):
   truncate_url = url
   if len(url) > _MAX_URL_DISPLAY_LEN:
     truncate_url = url[0:60] + '…'
@@ -89,7 +179,7 @@ def Clean(url):
       url, truncate_url, html)
 
 
-def _Clean(url, response=None):
+def _Clean(url, response=None, feed_cache=None):
   """Clean the contents of a given URL to only the "readable part".
 
   Handle special cases like YouTube, PDF, images directly.  Delegate out to
@@ -97,10 +187,93 @@ def _Clean(url, response=None):
 
   Args:
     url: String, the URL to the interesting content.
+    response: Optional, already fetched response for the URL.
+    feed_cache: Optional `extract_feed.FeedCache`, shared with other cleans.
 
   Returns:
     Tuple of strings: (final URL after redirects, HTML of the "readable part").
   """
+  url, html = _CleanSpecialUrl(url)
+  if html is not None:
+    timing.Note('path', 'special_url')
+    return url, html
+
+  if response is None:
+    response, final_url = _Fetch(url)
+
+    # Handle redirects to special pages.
+    if final_url != url:
+      return _Clean(final_url, response, feed_cache)
+  else:
+    final_url = url
+
+  html = _CleanSpecialContentType(url, response)
+  if html is not None:
+    timing.Note('path', 'special_content_type')
+    return url, html
+
+  soup, tag = _ExtractFromFeed(url, final_url, response.text, feed_cache)
+  if tag is None:
+    soup, tag = extract_content.ExtractFromHtml(final_url, response.text)
+  return final_url, _Munge(soup, tag, final_url)
+
+
+async def _CleanAsync(url, response=None, feed_cache=None):
+  """As `_Clean()`, from a coroutine.
+
+  Network-bound stages run in `_FETCH_EXECUTOR`, where many can wait at once;
+  CPU-bound ones in the smaller `_EXTRACT_EXECUTOR`.
+  """
+  url, html = _CleanSpecialUrl(url)
+  if html is not None:
+    timing.Note('path', 'special_url')
+    return url, html
+
+  if response is None:
+    response, final_url = await timing.RunInExecutor(
+        _FETCH_EXECUTOR, _ClosingDb(_Fetch), url)
+
+    # Handle redirects to special pages.
+    if final_url != url:
+      return await _CleanAsync(final_url, response, feed_cache)
+  else:
+    final_url = url
+
+  html = _CleanSpecialContentType(url, response)
+  if html is not None:
+    timing.Note('path', 'special_content_type')
+    return url, html
+
+  soup, tag = await timing.RunInExecutor(
+      _FETCH_EXECUTOR, _ClosingDb(_ExtractFromFeed),
+      url, final_url, response.text, feed_cache)
+  if tag is None:
+    soup, tag = await timing.RunInExecutor(
+        _EXTRACT_EXECUTOR, extract_content.ExtractFromHtml,
+        final_url, response.text)
+  html = await timing.RunInExecutor(
+      _EXTRACT_EXECUTOR, _Munge, soup, tag, final_url)
+  return final_url, html
+
+
+def _ClosingDb(func):
+  """Wrap a function, which may use the ORM, to run in an executor's thread.
+
+  Like `main._InThread()`, don't leave connections open in the pool's threads
+  (e.g. the redirect cache's, in `_Fetch()`).
+  """
+  @functools.wraps(func)
+  def inner(*args, **kwargs):
+    db.close_old_connections()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      db.close_old_connections()
+  return inner
+
+
+def NormalizeUrl(url):
+  """Normalize a URL; those that clean to the same content should match."""
   # Handle de-facto standard "hash bang" URLs ( http://goo.gl/LNmg )
   url = url.replace('#!', '?_escaped_fragment_=')
   # Otherwise ignore fragments.
@@ -108,62 +281,81 @@ def _Clean(url, response=None):
   # And strip common tracking noise.
   url = re.sub(r'[?&]utm_[^&]+', '', url)
 
-  url = url.replace('www.reddit.com', 'old.reddit.com')
+  return sites.Lookup(url).NormalizeUrl(url)
 
-  match = re.search(
-      r'^https?://docs.google.com.*cache:.*?:(.*?\.pdf)', url, re.I)
-  if match:
-    url = match.group(1)
-    if 'http' not in url:
-      url = 'http://' + url
 
-  match = re.search(r'^https?://docs.google.com.*docid=(.*?)(&|$)', url, re.I)
-  if match:
-    html = util.RenderTemplate(
-        'google-docs.html', {'docid': match.group(1), 'url': url})
+def _CleanSpecialUrl(url):
+  """Normalize a URL, and handle special cases that need no fetch.
+
+  Returns:
+    Tuple of (normalized URL, HTML or None if the URL is not special).
+  """
+  url = NormalizeUrl(url)
+
+  html = sites.Lookup(url).CleanUrl(url)
+  if html is not None:
     return url, html
 
-  if re.search(r'^https?://www\.youtube\.com/watch', url, re.I):
-    video_id = re.search(r'v=([^&]+)', url).group(1)
-    return url, util.RenderTemplate('youtube.html', {'video_id': video_id})
-  elif re.search(r'\.pdf(\?|$)', url, re.I):
+  if re.search(r'\.pdf(\?|$)', url, re.I):
     return url, util.RenderTemplate('pdf.html', {'url': url})
   elif re.search(r'\.(gif|jpe?g|png)(\?|$)', url, re.I):
     return url, util.RenderTemplate('image.html', {'url': url})
 
-  if response is None:
-    response, final_url = util.Fetch(url)
+  return url, None
 
-    # https://stackoverflow.com/a/52615216/91238
-    response.encoding = _BestEncoding(response)
 
-    # Handle redirects to special pages.
-    if final_url != url:
-      return _Clean(final_url, response)
-  else:
-    final_url = url
-
-  content_type = response.headers.get('content-type', None)
-  if 'application/pdf' == content_type:
-    return url, util.RenderTemplate('pdf.html', {'url': url})
+def _CleanSpecialContentType(url, response):
+  """Handle special cases by content type; return HTML, or None if not."""
+  content_type = response.headers.get('content-type', '')
+  if content_type.startswith('application/pdf'):
+    return util.RenderTemplate('pdf.html', {'url': url})
   elif content_type.startswith('image/'):
-    return url, util.RenderTemplate('image.html', {'url': url})
+    return util.RenderTemplate('image.html', {'url': url})
+  elif not util.IsTextContentType(content_type):
+    # Its body wasn't fetched.
+    return util.RenderTemplate(
+        'download.html', {'url': url, 'content_type': content_type})
+  return None
+
+
+def _ExtractFromFeed(url, final_url, html, feed_cache=None):
+  """Try to extract the content of a page from its site's feed.
 
-  note = ''
+  Returns:
+    Tuple of (soup, tag) to munge, or (None, None) if the feed has no good
+    content for this page.
+  """
   try:
-    if 'reddit.com/' in url: raise extract_feed.RssError
     extractor = extract_feed.FeedExtractor(
-        url=url, final_url=final_url, html=response.text)
-    note = 'cleaned feed'
-    soup = extractor.soup
-    tag = soup
+        url=url, final_url=final_url, html=html, feed_cache=feed_cache)
   except extract_feed.RssError as e:
     note = 'cleaned content, %s, %s' % (e.__class__.__name__, e)
-    soup, tag = extract_content.ExtractFromHtml(final_url, response.text)
+    soup = tag = None
+    timing.Note('path', 'html')
+    timing.Note('rss_error', e.__class__.__name__)
+    metrics.Inc('feed_extract_total', (e.__class__.__name__,))
+  else:
+    note = 'cleaned feed'
+    soup = tag = extractor.soup
+    timing.Note('path', 'feed')
+    metrics.Inc('feed_extract_total', ('ok',))
 
   if util.DEBUG:
     util.log.info('_Clean() note: %s', note)
-  return final_url, _Munge(soup, tag, final_url)
+  return soup, tag
+
+
+def _Fetch(url):
+  with timing.Stage('fetch'):
+    response, final_url = util.Fetch(
+        url, redirect_cache=_REDIRECT_CACHE, text_only=True,
+        max_bytes=settings.FETCH_MAX_BYTES)
+  timing.Note('html_bytes', len(response.content))
+  with timing.Stage('encoding'):
+    # https://stackoverflow.com/a/52615216/91238
+    response.encoding = _BestEncoding(response)
+  capture.Response(response, final_url)
+  return response, final_url
 
 
 def _FixUrls(parent, base_url):
@@ -196,32 +388,57 @@ def _Munge(soup, tag, url):
   if isinstance(tag, str):
     return tag
 
-  _MungeStripSiteSpecific(tag, url)
-  _MungeStripBrsAfterPs(tag)
-  _MungeStripRules(tag)
-  _MungeStripEmpties(tag)
-  tag = _MungeStripRootContainers(tag)
-  _MungeStripLowScored(tag)
-  _MungeStripAttrs(tag)
-
-  _FixUrls(tag, url)
-  _MungeImages(tag)
-  _MungeHeaderDowngrade(tag)
-  _MungeHyphenate(tag)
-  _MungeNoscript(tag)
-
-  # Serialize the tag, and apply full justification.
-  if isinstance(tag, bs4.BeautifulStoneSoup):
-    # Wrap in a div, to have a tag to justify, if necessary.
-    wrap = bs4.Tag(soup, name='div')
-    wrap.insert(0, tag)
-    tag = wrap
-
-  return str(tag)
+  with budget.Limit() as limit:
+    limit.Start()
+    with timing.Stage('munge_site_specific'):
+      sites.Lookup(url).Munge(url, tag)
+    with timing.Stage('munge_brs_after_ps'):
+      _MungeStripBrsAfterPs(tag)
+    with timing.Stage('munge_rules'):
+      _MungeStripRules(tag)
+    _MungeOptionalStage('munge_empties', _MungeStripEmpties, tag, url, limit)
+    with timing.Stage('munge_root_containers'):
+      tag = _MungeStripRootContainers(tag)
+    with timing.Stage('munge_low_scored'):
+      _MungeStripLowScored(tag)
+    with timing.Stage('munge_attrs'):
+      _MungeStripAttrs(tag)
+
+    with timing.Stage('munge_urls'):
+      _FixUrls(tag, url)
+    with timing.Stage('munge_images'):
+      _MungeImages(tag)
+    with timing.Stage('munge_headers'):
+      _MungeHeaderDowngrade(tag)
+    _MungeOptionalStage('munge_hyphenate', _MungeHyphenate, tag, url, limit)
+    with timing.Stage('munge_noscript'):
+      _MungeNoscript(tag)
+
+    # Serialize the tag, and apply full justification.
+    if isinstance(tag, bs4.BeautifulStoneSoup):
+      # Wrap in a div, to have a tag to justify, if necessary.
+      wrap = bs4.Tag(soup, name='div')
+      wrap.insert(0, tag)
+      tag = wrap
+
+    return str(tag)
+
+
+def _MungeOptionalStage(name, func, tag, url, limit):
+  """Run a munge stage that can be skipped, unless over the time budget."""
+  if limit.Spent():
+    limit.Degrade('munge_partial', 'seconds', url)
+    return
+  with timing.Stage(name):
+    try:
+      func(tag)
+    except budget.OverBudgetError:
+      limit.Degrade('munge_partial', 'seconds', url)
 
 
 def _MungeHyphenate(root_tag):
   for text in root_tag.findAll(text=True):
+    budget.Check()
     if text.findParent('pre'):
       continue
     text_parts = re.split(r'(&[^;]{2,6};)', text)
@@ -286,27 +503,59 @@ def _MungeStripBrsAfterPs(root_tag):
 
 
 def _MungeStripEmpties(root_tag):
+  """Strip tags with no text and no tags but <br>s, once their empties are.
+
+  One pass from the last node back, so each tag is seen after everything in
+  it: whether it holds text, or tags besides <br> and <hr>, is gathered from
+  its children, rather than by searching its subtree.
+  """
   strip_tags = (
       'a', 'center', 'div', 'li', 'ol', 'p', 'table', 'td', 'th', 'tr',
       'span', 'ul',
       'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
       )
 
-  def _StripIfEmpty(tag):
-    if not tag or not tag.name or tag.name not in strip_tags:
-      # We have to double check this, because of the parent recursion.
-      return
-    if tag.text.strip():
-      return
-    if tag.find(lambda tag: tag.name not in ('br', 'hr')):
-      return
-    parent = tag.parent
-    util.Strip(tag)
-    # Also consider the parent, which might now be empty.
-    _StripIfEmpty(parent)
+  # What each tag holds, by id: as bits of _HOLDS_*.
+  holds = {}
+  empties = []
+  for node in reversed(list(root_tag.descendants)):
+    budget.Check()
+    parent_id = id(node.parent)
+    if not isinstance(node, bs4.Tag):
+      if node.strip():
+        bits = _HOLDS_TEXT
+        if type(node) in _PLAIN_STRING_TYPES:
+          bits |= _HOLDS_PLAIN_TEXT
+        holds[parent_id] = holds.get(parent_id, 0) | bits
+      continue
+    bits = holds.get(id(node), 0)
+    if node.name in strip_tags and _IsEmpty(node, bits):
+      empties.append(node)
+      # Stripping only marks it, with DEBUG; then it still counts.
+      bits = _HOLDS_TAG if util.DEBUG else 0
+    elif node.name not in ('br', 'hr'):
+      bits |= _HOLDS_TAG
+    if bits:
+      holds[parent_id] = holds.get(parent_id, 0) | bits
+
+  # Those inside another go with it.
+  empty_ids = set(id(tag) for tag in empties)
+  for tag in reversed(empties):
+    if id(tag.parent) not in empty_ids:
+      util.Strip(tag)
+
 
-  for tag in root_tag.findAll(strip_tags):
-    _StripIfEmpty(tag)
+def _IsEmpty(tag, holds):
+  """Whether a tag is empty, given the _HOLDS_* bits of what it holds."""
+  if holds & _HOLDS_TAG:
+    return False
+  # As `tag.text`, which only counts some types of strings.
+  types = tag.interesting_string_types
+  if types is None:
+    return not holds & _HOLDS_TEXT
+  if types == _PLAIN_STRING_TYPES:
+    return not holds & _HOLDS_PLAIN_TEXT
+  return not tag.text.strip()
 
 
 def _MungeStripLowScored(root_tag):
@@ -317,11 +566,12 @@ def _MungeStripLowScored(root_tag):
 
 def _MungeStripRootContainers(root_tag):
   # If this container holds only one tag, and empty text, choose that inner tag.
-  child_tags = root_tag.findAll(True, recursive=False)
-  if len(child_tags) != 1: return root_tag
-  if ''.join(root_tag.findAll(text=True, recursive=False)).strip():
-    return root_tag
-  return _MungeStripRootContainers(child_tags[0])
+  while True:
+    child_tags = root_tag.findAll(True, recursive=False)
+    if len(child_tags) != 1: return root_tag
+    if ''.join(root_tag.findAll(text=True, recursive=False)).strip():
+      return root_tag
+    root_tag = child_tags[0]
 
 
 def _MungeStripRules(root_tag):
@@ -330,9 +580,3 @@ def _MungeStripRules(root_tag):
       util.Strip(root_tag.contents[-1])
   except AttributeError:
     pass
-
-
-def _MungeStripSiteSpecific(root_tag, url):
-  if 'smashingmagazine.com' in url:
-    for tag in root_tag.findAll('table', width='650'):
-      util.Strip(tag)
@@ -0,0 +1,54 @@
+"""Saved pages for offline benchmarks and regression checks.
+
+The corpus lives in `testdata/corpus/`; `manifest.json` there lists each page's
+name, file, the URL it stands in for (which selects site-specific handling)
+and what it exercises.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import json
+import pathlib
+
+CORPUS_DIR = pathlib.Path(__file__).parent / 'testdata' / 'corpus'
+
+Page = collections.namedtuple('Page', ('name', 'url', 'html', 'description'))
+
+
+def Pages(names=None):
+  """Return the corpus `Page`s, in manifest order.
+
+  Args:
+    names: If given, only the pages with these names.
+  """
+  with open(CORPUS_DIR / 'manifest.json') as f:
+    manifest = json.load(f)
+  pages = []
+  for entry in manifest:
+    if names and entry['name'] not in names:
+      continue
+    with open(CORPUS_DIR / entry['file'], encoding='utf-8') as f:
+      html = f.read()
+    pages.append(Page(entry['name'], entry['url'], html, entry['description']))
+  if names:
+    unknown = set(names) - {page.name for page in pages}
+    if unknown:
+      raise KeyError('Unknown corpus pages: %s' % ', '.join(sorted(unknown)))
+  return pages
@@ -23,81 +23,150 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import argparse
+import contextlib
+import contextvars
 import re
 import sys
 
 import bs4
 
+from readability import budget
 from readability import patterns
+from readability import profiling
+from readability import settings
+from readability import sites
+from readability import timing
 from readability import util
 
 
+_PICKS = contextvars.ContextVar('picks', default=None)
+
+
+@contextlib.contextmanager
+def RecordPicks():
+  """Record how the best node is picked, for checking against known output.
+
+  Yields a list, to which each generic extraction within appends a dict: the
+  'best_node' path, and the top 'scored_nodes' as (path, score), best last.
+  """
+  picks = []
+  token = _PICKS.set(picks)
+  try:
+    yield picks
+  finally:
+    _PICKS.reset(token)
+
+
 def ExtractFromHtml(url, html):
   """Given a string of HTML, remove nasty bits, score and pick bit to keep."""
-  if re.search(r'^http://(www\.)?reddit\.com/.*/comments/', url, re.I):
-    strainer = bs4.SoupStrainer(
-        attrs={'class': re.compile(r'thing.*link|usertext border')})
-    soup = bs4.BeautifulSoup(html, 'html.parser', parseOnlyThese=strainer)
-    body = soup.find(attrs={'class': re.compile(r'\busertext-body\b')})
-    if not body:
-      body = soup.find('a', attrs={'class': re.compile(r'\btitle\b')})
-      body = body and body.text or soup
-    return soup, body
-  elif re.search(r'^https://gfycat.com/[a-zA-Z]+$', url, re.I):
-    soup = bs4.BeautifulSoup(html, 'html.parser')
-    vid = soup.find('video')
-    del vid['autoplay']
-    vid['controls'] = 'controls'
-    return soup, vid
-  elif re.search(r'^http://(www\.)?xkcd\.com/\d+', url, re.I):
-    soup = bs4.BeautifulSoup(html, 'html.parser')
-    img = soup.find(alt=True, title=True)
-    cont = img.parent.parent
-    for tag in cont.findAll(('br', 'div')):
-      util.Strip(tag)
-    return soup, cont
-  elif re.search(r'^http://groups\.google\.com/', url, re.I):
-    strainer = bs4.SoupStrainer(attrs={'class': 'maincontbox'})
-    soup = bs4.BeautifulSoup(html, 'html.parser', parseOnlyThese=strainer)
-    return _ExtractFromHtmlGeneric(url, str(soup))
-  elif re.search(r'\.txt(\?|$)', url, re.I):
-    soup = bs4.BeautifulSoup(features='html.parser')
+  site = sites.Lookup(url)
+  extracted = site.Extract(url, html)
+  if extracted is not None:
+    return extracted
+  strainer = site.Strainer(url)
+  if strainer is not None:
+    soup = util.Soup(html, parse_only=strainer)
+    return _ExtractFromHtmlGeneric(url, str(soup), site, fragment=True)
+  if re.search(r'\.txt(\?|$)', url, re.I):
+    soup = util.Soup(fragment=True)
     pre = bs4.Tag(soup, name='pre')
     pre.insert(0, bs4.NavigableString(html))
     soup.insert(0, pre)
     return soup, soup
-  else:
-    return _ExtractFromHtmlGeneric(url, html)
-
-
-def _ExtractFromHtmlGeneric(url, html):
-  html = util.PreCleanHtml(html)
-  soup = bs4.BeautifulSoup(html, 'html.parser')
-  util.CommentStrip(soup)
-
-  title = soup.find('title')
-  title = title and title.text.lower() or ''
+  return _ExtractFromHtmlGeneric(url, html, site)
+
+
+def _ExtractFromHtmlGeneric(url, html, site, fragment=False):
+  with budget.Limit() as limit:
+    limit.Start()
+    if settings.EXTRACT_MAX_CHARS and len(html) > settings.EXTRACT_MAX_CHARS:
+      limit.Degrade('truncated', 'chars', url)
+      html = html[:settings.EXTRACT_MAX_CHARS]
+
+    with timing.Stage('parse'):
+      html = util.PrunePayloads(util.PreCleanHtml(html))
+      soup = util.Soup(html, fragment=fragment)
+      node_count = util.CommentStrip(soup)
+    timing.Note('node_count', node_count)
+    if settings.EXTRACT_MAX_NODES and node_count > settings.EXTRACT_MAX_NODES:
+      return _ExtractOverBudget(url, soup, limit, 'nodes')
+
+    title = soup.find('title')
+    title = title and title.text.lower() or ''
+
+    try:
+      with util.ScoreIndexed(soup) as index:
+        with timing.Stage('patterns'):
+          patterns.Process(soup, url)
+          site.PostScore(url, soup)
+
+        with timing.Stage('pick'):
+          return _PickBestNode(url, soup, title, site, index)
+    except budget.OverBudgetError:
+      return _ExtractOverBudget(url, soup, limit, 'seconds')
+
+
+def _ExtractOverBudget(url, soup, limit, reason):
+  """Cheaply pick content from a page too costly to extract normally."""
+  if limit.fallback is not None:
+    limit.Degrade('feed', reason, url)
+    return limit.fallback
+  limit.Degrade('density', reason, url)
+  with timing.Stage('pick_density'):
+    return soup, _PickByTextDensity(soup)
+
+
+def _PickByTextDensity(soup):
+  """The tag whose child blocks hold the most text; or the soup, if none."""
+  text_lens = {}
+  containers = {}
+  for text in soup.find_all(string=True):
+    if type(text) is not bs4.NavigableString or text.parent.name == 'a':
+      continue
+    # The nearest enclosing block, if it's near.
+    block = text.parent
+    for unused_depth in range(util.MAX_SCORE_DEPTH):
+      if block is None or block.name in util.TAG_NAMES_BLOCK:
+        break
+      block = block.parent
+    if block is None or block.parent is None:
+      continue
+    container = block.parent
+    text_lens[id(container)] = text_lens.get(id(container), 0) + len(
+        text.strip())
+    containers[id(container)] = container
+  if not text_lens:
+    return soup
+  return containers[max(text_lens, key=text_lens.get)]
 
-  _TransformBrsToParagraphs(soup)
-  patterns.Process(soup, url)
-  _SiteSpecific(url, soup)
 
+def _PickBestNode(url, soup, title, site, index=None):
   # If a header repeats the title, strip it and all preceding nodes.
   title_header = _FindTitleHeader(soup, title)
   if title_header:
     if util.DEBUG:
       util.log.info('Picked title header %s', util.SoupTagOnly(title_header))
     util.ApplyScore(title_header, 11, name='title_header')
-    if 'flickr.com' not in url:
+    if site.strip_before_title:
       _StripBefore(title_header)
 
   # Get the highest scored nodes.
-  nodes = soup.findAll(attrs={'score': True})
-  nodes = filter(lambda x: type(x['score']) is float, nodes)
-  scored_nodes = sorted(nodes, key=lambda x: x['score'])[-15:]
+  scored_nodes = index.TopScored(15) if index is not None else None
+  if scored_nodes is None:
+    nodes = soup.findAll(attrs={'score': True})
+    nodes = filter(lambda x: type(x['score']) is float, nodes)
+    scored_nodes = sorted(nodes, key=lambda x: x['score'])[-15:]
   if not scored_nodes:
     return soup, '<p>Scoring error.</p>'
   best_node = scored_nodes[-1]
+  picks = _PICKS.get()
+  if picks is not None:
+    picks.append({
+        'best_node': util.NodePath(best_node),
+        'scored_nodes': [
+            (util.NodePath(node), node['score']) for node in scored_nodes],
+        })
   if util.DEBUG:
     best_node['style'] = 'outline: 2px dotted green'
     if not best_node.has_attr('class'):
@@ -130,72 +199,50 @@ def _FindTitleHeader(root_tag, title_text):
       return header
 
 
-def _SiteSpecific(url, root_tag):
-  if 'www.cracked.com' in url:
-    tag = root_tag.find(attrs={'class': 'Column2'})
-    if tag: util.Strip(tag)
-    tag = root_tag.find(attrs={'class': 'userStyled'})
-    if tag: util.ApplyScore(tag, 20, name='special')
-  if '.reddit.com' in url:
-    tag = root_tag.find(attrs={'class': 'side'})
-    if tag: util.Strip(tag, 'reddit side')
-
-
 def _StripBefore(strip_tag):
   if util.DEBUG:
     util.log.info('Strip before: %s', util.SoupTagOnly(strip_tag))
-  ancestors = strip_tag.findParents(True)
+  # By identity: `==` on tags compares their whole subtrees.
+  ancestors = set(id(tag) for tag in strip_tag.parents)
   for tag in strip_tag.findAllPrevious():
-    if tag in ancestors:
+    if id(tag) in ancestors:
       # Don't strip the tags that contain the strip_tag.
       continue
     util.Strip(tag, 'before title')
   util.Strip(strip_tag, 'before title')
 
 
-def _TransformBrsToParagraphs(soup):
-  for tag in soup.findAll('br'):
-    _TransformBrsToParagraphsInner(soup, tag)
-
-
-def _TransformBrsToParagraphsInner(soup, tag):
-  next_tag = tag
-  while True:
-    next_tag = next_tag.next_tagSibling
-    if not next_tag:
-      return
-    if isinstance(next_tag, bs4.Tag):
-      if next_tag.name == 'br':
-        break
-      else:
-        return
-    elif isinstance(next_tag, bs4.NavigableString):
-      if not str(next_tag).strip():
-        continue
-      else:
-        return
-
-  contents = []
-  prev = tag
-  while True:
-    prev = prev.previousSibling
-    if not prev: break
-    if hasattr(prev, 'name') and prev.name in util.BR_TO_P_STOP_TAGS: break
-    contents.insert(0, prev)
-
-  newp = bs4.Tag(soup, name='p')
-  for i, newtag in enumerate(contents):
-    newp.insert(i, newtag)
-  util.Strip(next_tag, 'br to p')
-  tag.replaceWith(newp)
-
-
 def _TransformDivsToPs(root_tag):
   for tag in root_tag.findAll('div'):
     if not tag.find(util.TAG_NAMES_BLOCK):
       tag.name = 'p'
 
 
+def _Main(argv):
+  parser = argparse.ArgumentParser(
+      description='Extract the readable part of a saved HTML page.')
+  parser.add_argument(
+      'file', type=argparse.FileType('r'), help='HTML file, or - for stdin')
+  parser.add_argument(
+      '--url', default='http://www.example.com',
+      help='URL the page came from; selects site-specific handling')
+  parser.add_argument(
+      '--profile', action='store_true',
+      help='Print a profile of the extraction instead of its output')
+  parser.add_argument(
+      '--top', type=int, default=profiling.TOP_FUNCTIONS,
+      help='Functions to list in the profile')
+  args = parser.parse_args(argv)
+
+  html = args.file.read()
+  if args.profile:
+    unused_result, report = profiling.Profile(
+        args.url, ExtractFromHtml, args.url, html, top=args.top)
+    print(report)
+  else:
+    unused_soup, tag = ExtractFromHtml(args.url, html)
+    print(tag)
+
+
 if __name__ == '__main__':
-  # For debugging, assume file on command line.
-  print(ExtractFromHtml('http://www.example.com', open(sys.argv[1]).read()))
+  _Main(sys.argv[1:])
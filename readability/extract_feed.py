@@ -15,6 +15,8 @@ Usage example:
 Note that the html argument to the constructor is optional, but can be provided
 to avoid a second URL fetch in the case that it is already known.  If it is
 provided, the "final" URL (after possible redirects) should also be provided.
+When extracting many pages, pass the same `FeedCache` to each, so that every
+feed is only downloaded once.
 
 --------------------------------------------------------------------------------
 
@@ -35,13 +37,18 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import concurrent.futures
 import re
+import threading
 import urllib.parse
 
-import bs4
 from third_party import autorss
 
+from readability import budget
+from readability import metrics
 from readability import patterns
+from readability import sites
+from readability import timing
 from readability import util
 
 
@@ -69,6 +76,31 @@ class NoRssContentError(RssError):
   pass
 
 
+class FeedCache(object):
+  """Parsed feeds, shared by the `FeedExtractor`s for many pages.
+
+  Safe to share between threads; each feed is downloaded at most once.
+  """
+
+  def __init__(self):
+    self._futures = {}
+    self._lock = threading.Lock()
+
+  def Get(self, feed_url):
+    with self._lock:
+      future = self._futures.get(feed_url)
+      is_owner = future is None
+      if is_owner:
+        future = self._futures[feed_url] = concurrent.futures.Future()
+    metrics.Inc('cache_total', ('feed', 'miss' if is_owner else 'hit'))
+    if is_owner:
+      try:
+        future.set_result(util.ParseFeedAtUrl(feed_url))
+      except Exception as e:
+        future.set_exception(e)
+    return future.result()
+
+
 def TrimQuery(url):
   return url.split('?')[0]
 
@@ -76,12 +108,12 @@ def TrimQuery(url):
 class FeedExtractor(object):
   """Clean a page to its readable part by extracting from the site's feed."""
 
-  def __init__(self, url=None, final_url=None, html=None):
+  def __init__(self, url=None, final_url=None, html=None, feed_cache=None):
     assert url, 'URL must be provided.'
     self.url = url
 
-    if re.search(r'^https?://(docs|spreadsheets)\.google\.', url, re.I):
-      raise UnsupportedRssError('skip google docs')
+    if not sites.Lookup(url).use_feed:
+      raise UnsupportedRssError('skip site without usable feed')
 
     if final_url or html:
       assert (final_url and html), ('If either is, both final_url and '
@@ -91,26 +123,37 @@ class FeedExtractor(object):
     else:
       self.html, self.final_url = util.Fetch(url)
 
-    feed_url = self._DetectFeed()
+    with timing.Stage('feed_discover'):
+      feed_url = self._DetectFeed()
     feed_url = re.sub(r'^feed://', 'http://', feed_url)
 
-    self.feed = util.ParseFeedAtUrl(feed_url)
+    if feed_cache:
+      self.feed = feed_cache.Get(feed_url)
+    else:
+      self.feed = util.ParseFeedAtUrl(feed_url)
     if not self.feed:
       raise NoRssError('could not download/parse feed')
 
-    self._FindEntry()
+    with timing.Stage('feed_match'):
+      self._FindEntry()
+
+    with timing.Stage('feed_content'):
+      self._ExtractContent(url)
 
+  def _ExtractContent(self, url):
     self.content = util.PreCleanHtml(util.GetFeedEntryContent(self.entry))
     if not self.content:
       raise NoRssContentError('no content found')
 
     # Now, we've found content.  Check if it's legit.
     html = re.sub(r'<!--.*?-->', '', self.content)
-    self.soup = bs4.BeautifulSoup(html, 'html.parser')
+    self.soup = util.Soup(html, fragment=True)
     util.CommentStrip(self.soup)
     for tag in self.soup.findAll('script'):
       util.Strip(tag)
     text = self.soup.text
+    # Not good enough to use, unless the page is too costly to extract.
+    budget.SetFallback(self.soup, self.soup)
     if re.search(r'\[?\.\.\.\]?\s*$', text):
       raise NoRssContentError('trailing ellipsis')
     if len(text) < MIN_FEED_TEXT_LEN:
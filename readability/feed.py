@@ -20,17 +20,24 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import base64
+import collections
+import concurrent.futures
 import datetime
 import hashlib
 import logging
 import operator
+import threading
 import time
 
+from django import db
 from django import template
+from django.db import transaction
 from huey.contrib.djhuey import  db_task
 
 from readability import clean
 from readability import models
+from readability import sites
+from readability import task_queue
 from readability import util
 
 
@@ -42,12 +49,23 @@ _EMPTY_ENTRY = {
     'tags': [],
     }
 
+# Feed URLs being created by `CreateFeed()` right now, to their results.
+_CREATING = {}
+_CREATING_LOCK = threading.Lock()
+
 _MAX_UPDATE_INTERVAL = datetime.timedelta(days=3).total_seconds()
 _MIN_UPDATE_INTERVAL = datetime.timedelta(hours=1).total_seconds()
 
 
-def _CleanEntryBase(feed_entity, entry_feedparser, content, original_content):
-  dt = entry_feedparser.updated_parsed or entry_feedparser.published_parsed
+# Everything `_CleanEntry` needs to know about one feed entry.  Queued tasks
+# carry this instead of the feed model and the (large) feedparser entry.
+_EntryRecord = collections.namedtuple('_EntryRecord', (
+    'feed_url', 'key', 'link', 'title', 'updated', 'tags', 'original_content'))
+
+
+def _EntryRecordFromFeedparser(feed_url, entry_feedparser):
+  dt = (entry_feedparser.get('updated_parsed')
+        or entry_feedparser.get('published_parsed'))
   if dt:
     updated = datetime.datetime(*dt[:6])
   else:
@@ -63,25 +81,32 @@ def _CleanEntryBase(feed_entity, entry_feedparser, content, original_content):
   except AttributeError:
     title = 'Unknown'
 
-  try:
-    link = entry_feedparser.link
-  except AttributeError:
-    link = 'Unknown'
-
-  entry_entity = models.Entry(
+  return _EntryRecord(
+      feed_url=feed_url,
       key=_EntryId(entry_feedparser),
-      feed=feed_entity,
+      link=entry_feedparser.get('link'),
       title=title,
-      link=link,
       updated=updated,
+      tags=tags,
+      original_content=util.GetFeedEntryContent(entry_feedparser))
+
+
+def _CleanEntryBase(entry_record, content, original_content):
+  entry_entity = models.Entry(
+      key=entry_record.key,
+      # Only the key is needed; don't load the feed row to save an entry.
+      feed_id=entry_record.feed_url,
+      title=entry_record.title,
+      link=entry_record.link or 'Unknown',
+      updated=entry_record.updated,
       content=content,
       original_content=original_content,
-      tags=tags)
+      tags=entry_record.tags)
   entry_entity.save()
 
 
-def _CleanEntryFailure(feed_entity, entry_feedparser, ex, original_content):
-  url = entry_feedparser.link
+def _CleanEntryFailure(entry_record, ex):
+  url = entry_record.link
   truncate_url = url
   if len(url) > clean._MAX_URL_DISPLAY_LEN:
     truncate_url = url[0:60] + '…'
@@ -90,52 +115,43 @@ def _CleanEntryFailure(feed_entity, entry_feedparser, ex, original_content):
 <pre style="pre-wrap'>%s</pre>
 ''' % (url, truncate_url, ex)
   _CleanEntryBase(
-      feed_entity, entry_feedparser,
-      content=content, original_content=original_content)
+      entry_record,
+      content=content, original_content=entry_record.original_content)
 
 
+@task_queue.Unique(lambda entry_record: entry_record.key)
 @db_task()
-def _CleanEntry(feed_entity, entry_feedparser):
-  """Given a parsed feed entry, turn it into a cleaned entry entity."""
+def _CleanEntry(entry_record):
+  """Given an entry record, turn it into a cleaned entry entity."""
   util.log.info(
       'For feed %r, cleaning entry %r ...',
-      feed_entity.url,
-      getattr(entry_feedparser, 'link', 'UNKNOWN'))
-  if not hasattr(entry_feedparser, 'link'):
+      entry_record.feed_url, entry_record.link or 'UNKNOWN')
+  if not entry_record.link:
     util.log.warn('Missing link attribute!?')
     return
 
-  original_content = util.GetFeedEntryContent(entry_feedparser)
-
-  if any((
-      '.reddit.com/' in entry_feedparser.link,
-      '.redd.it/' in entry_feedparser.link,
-      )):
-    # Don't hammer reddit's servers, original feed content instead.
-    # (Otherwise our IP gets banned and we can't fetch anyway.)
+  if not sites.Lookup(entry_record.link).fetch_entries:
     _CleanEntryBase(
-        feed_entity, entry_feedparser,
-        content=original_content, original_content='')
+        entry_record,
+        content=entry_record.original_content, original_content='')
     return
 
   i = 0
   while True:
     try:
-      content = clean.Clean(entry_feedparser.link)
+      content = clean.Clean(entry_record.link)
       _CleanEntryBase(
-          feed_entity, entry_feedparser,
-          content=content, original_content=original_content)
+          entry_record,
+          content=content, original_content=entry_record.original_content)
     except Exception as ex:
       util.log.info(
-          'Got error %d cleaning %s: %s', i, entry_feedparser.link, ex)
+          'Got error %d cleaning %s: %s', i, entry_record.link, ex)
       time.sleep(15)
       i += 1
       if i < 3:
         continue
       else:
-        _CleanEntryFailure(
-            feed_entity, entry_feedparser, ex,
-            original_content=original_content)
+        _CleanEntryFailure(entry_record, ex)
     break
 
 
@@ -149,25 +165,102 @@ def _EntryId(entry_feedparser):
 
 
 def CreateFeed(url):
+  """Store a new feed, and queue its entries to be cleaned in the background.
+
+  Concurrent calls for the same URL (in this process) share one fetch.
+
+  Returns:
+    Tuple of (feed entity, list of placeholder entries showing the original
+    feed content, to serve until cleaned entries are stored).
+  """
+  with _CREATING_LOCK:
+    future = _CREATING.get(url)
+    is_owner = future is None
+    if is_owner:
+      future = _CREATING[url] = concurrent.futures.Future()
+  if not is_owner:
+    return future.result()
+
+  try:
+    result = _CreateFeed(url)
+  except Exception as e:
+    future.set_exception(e)
+    raise
+  else:
+    future.set_result(result)
+    return result
+  finally:
+    with _CREATING_LOCK:
+      del _CREATING[url]
+
+
+def _CreateFeed(url):
   feed_feedparser = util.ParseFeedAtUrl(url)
   feed_entity = models.Feed(
       url=url,
       title=feed_feedparser.feed.title,
       link=feed_feedparser.feed.link)
-  feed_entity.save()
-  UpdateFeed.call_local(feed_entity.url, feed_feedparser, local=True)
-  return feed_entity
-
-
-def RenderFeed(feed_entity, include_original=False):
+  try:
+    with transaction.atomic():
+      feed_entity.save(force_insert=True)
+  except db.IntegrityError:
+    # Another process created it first, and is cleaning its entries.
+    return models.Feed.objects.get(url=url), None
+
+  entry_records = _ScheduleNewEntries(feed_entity, feed_feedparser)
+  placeholders = [{
+      'key': entry_record.key,
+      'title': entry_record.title,
+      'link': entry_record.link or 'about:blank',
+      'updated': entry_record.updated,
+      'content': entry_record.original_content,
+      'tags': entry_record.tags,
+      } for entry_record in entry_records]
+  return feed_entity, placeholders
+
+
+def RenderFeed(feed_entity, include_original=False, placeholders=None):
   tpl = template.loader.get_template('feed.xml')
   return tpl.render({
       'feed': feed_entity,
-      'entries': feed_entity.entries or [_EMPTY_ENTRY],
+      'entries': feed_entity.entries or placeholders or [_EMPTY_ENTRY],
       'include_original': include_original,
    })
 
 
+def _ScheduleNewEntries(feed_entity, feed_feedparser):
+  """Queue cleaning of each feed entry not yet stored.
+
+  Returns:
+    List of the entry records queued.
+  """
+  entries = sorted(
+      feed_feedparser.entries,
+      key=operator.attrgetter('published_parsed'),
+      reverse=True)
+  entries = entries[:models.MAX_ENTRIES_PER_FEED]
+
+  existing_keys = models.Entry.objects.filter(
+      feed__url=feed_entity.url).values('key')
+  existing_keys = set(x['key'] for x in existing_keys)
+
+  util.log.info(
+      'Downloaded %d entries, already have %d ...',
+      len(entries), len(existing_keys))
+  delay = 1
+  entry_records = []
+  for entry_feedparser in entries:
+    if _EntryId(entry_feedparser) in existing_keys:
+      continue
+    entry_record = _EntryRecordFromFeedparser(feed_entity.url, entry_feedparser)
+    _CleanEntry.schedule((entry_record,), delay=delay)
+    entry_records.append(entry_record)
+    delay += 3
+
+  _UpdateFeedInterval(feed_entity, bool(entry_records))
+  return entry_records
+
+
 def _UpdateFeedInterval(feed_entity, had_new_items):
   f = feed_entity.fetch_interval_seconds
   f *= 0.9 if had_new_items else 1.1
@@ -179,43 +272,16 @@ def _UpdateFeedInterval(feed_entity, had_new_items):
   feed_entity.save()
 
 
+@task_queue.Unique(lambda feed_url: feed_url)
 @db_task()
-def UpdateFeed(feed_url, feed_feedparser=None, local=False):
+def UpdateFeed(feed_url):
   util.log.info('Updating feed %r ...', feed_url)
 
   feed_entity = models.Feed.objects.get(url=feed_url)
-  if not feed_feedparser:
-    feed_feedparser = util.ParseFeedAtUrl(feed_entity.url)
+  feed_feedparser = util.ParseFeedAtUrl(feed_entity.url)
   if not feed_feedparser:
     # Bad fetch, ignore.
     _UpdateFeedInterval(feed_entity, False)
     return
 
-  entries = sorted(
-      feed_feedparser.entries,
-      key=operator.attrgetter('published_parsed'),
-      reverse=True)
-  entries = entries[:models.MAX_ENTRIES_PER_FEED]
-
-  entry_keys = [_EntryId(e) for e in entries]
-  existing_keys = models.Entry.objects.filter(feed__url=feed_url).values('key')
-  existing_keys = set(x['key'] for x in existing_keys)
-
-  util.log.info(
-      'Downloaded %d entries, already have %d ...',
-      len(entries), len(existing_keys))
-  delay = 1
-  new_entries = False
-  for entry_feedparser in entries:
-    if _EntryId(entry_feedparser) in existing_keys:
-      continue
-    new_entries = True
-    args = (feed_entity, entry_feedparser)
-    if local:
-      _CleanEntry.call_local(*args)
-      time.sleep(1)
-    else:
-      _CleanEntry.schedule(args, delay=delay)
-    delay += 3
-
-  _UpdateFeedInterval(feed_entity, new_entries)
+  _ScheduleNewEntries(feed_entity, feed_feedparser)
@@ -17,29 +17,77 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import email.utils
+import json
+import os
 import re
 import time
 
+import asgiref.sync
+from django import db
 from django import http
 from django import template
+from django.db.models import F
+from huey.contrib.djhuey import HUEY
 
 from readability import clean
 from readability import feed
+from readability import metrics
 from readability import models
+from readability import profiling
+from readability import response_cache
+from readability import settings
+from readability import task_queue
+from readability import timing
 from readability import util
 
 
+_MAX_BATCH_URLS = 100
+# Share this process's metrics with the stats page at most this often.
+_METRICS_PUBLISH_SEC = 60
+
+
 def Main(request):
   tpl = template.loader.get_template('main.html')
   return http.HttpResponse(tpl.render({}, request))
 
 
-def CleanPage(request):
+def _InThread(func):
+  """Wrap a blocking function, which may use the ORM, to await in a thread.
+
+  Like `huey.contrib.djhuey.close_db()`, don't leave connections open in the
+  pool's threads.
+  """
+  def inner(*args, **kwargs):
+    db.close_old_connections()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      db.close_old_connections()
+  return asgiref.sync.sync_to_async(inner, thread_sensitive=False)
+
+
+async def _PublishMetrics():
+  await _InThread(task_queue.PublishMetrics)(HUEY, _METRICS_PUBLISH_SEC)
+
+
+async def CleanPage(request):
   url = request.GET.get('url')
 
-  if url:
-    response = http.HttpResponse(clean.Clean(url))
+  if url and profiling.Allowed(request.GET.get('profile')):
+    # Profile the synchronous clean, all in one thread, so that cProfile sees
+    # every stage.
+    unused_result, report = await _InThread(profiling.Profile)(
+        url, clean._Clean, url)
+    response = http.HttpResponse(report)
+    response['Content-Type'] = 'text/plain; charset=UTF-8'
+    response['Cache-Control'] = 'no-store'
+    return response
+  elif url:
+    with timing.Collect() as timings:
+      response = http.HttpResponse(await clean.CleanAsync(url))
     response['Content-Type'] = 'text/html; charset=UTF-8'
+    response['Server-Timing'] = timings.ServerTiming()
+    await _PublishMetrics()
   else:
     response = http.HttpResponse('Provide "url" parameter!')
     response['Content-Type'] = 'text/plain; charset=UTF-8'
@@ -50,7 +98,33 @@ def CleanPage(request):
   return response
 
 
-def CleanFeed(request):
+async def CleanBatch(request):
+  """Clean many pages, streaming each result as one line of JSON."""
+  urls = request.GET.getlist('url') + request.POST.getlist('url')
+  if not urls or len(urls) > _MAX_BATCH_URLS:
+    response = http.HttpResponse(
+        'Provide 1 to %d "url" parameters!' % _MAX_BATCH_URLS)
+    response['Content-Type'] = 'text/plain; charset=UTF-8'
+    return response
+
+  async def Lines():
+    async for same_urls, html, error in clean.CleanManyAsync(urls):
+      for url in same_urls:
+        if error:
+          result = {
+              'url': url,
+              'error': '%s: %s' % (error.__class__.__name__, error)}
+        else:
+          result = {'url': url, 'content': html}
+        yield json.dumps(result) + '\n'
+    await _PublishMetrics()
+
+  response = http.StreamingHttpResponse(Lines())
+  response['Content-Type'] = 'application/x-ndjson; charset=UTF-8'
+  return response
+
+
+async def CleanFeed(request):
   url = request.GET.get('url')
   include_original = request.GET.get('include', None) == 'True'
 
@@ -60,12 +134,70 @@ def CleanFeed(request):
     return response
 
   url = re.sub(r'\?at=[^?&]+', '', url)
+  placeholders = None
   try:
-    feed_entity = models.Feed.objects.get(url=url)
+    feed_entity = await models.Feed.objects.aget(url=url)
   except models.Feed.DoesNotExist:
-    feed_entity = feed.CreateFeed(url)
+    feed_entity, placeholders = await _InThread(feed.CreateFeed)(url)
 
-  response = http.HttpResponse(
-      feed.RenderFeed(feed_entity, include_original))
+  response = http.HttpResponse(await _InThread(feed.RenderFeed)(
+      feed_entity, include_original, placeholders))
   response['Content-Type'] = 'application/atom+xml; charset=UTF-8'
   return response
+
+
+def _Gauges():
+  """Current values describing the queue, feeds and database."""
+  gauges = {}
+  for name, value in task_queue.Stats(HUEY).items():
+    gauges['queue_' + name] = value
+
+  now = time.time()
+  feeds = models.Feed.objects.annotate(
+      next_fetch_time=F('last_fetch_time') + F('fetch_interval_seconds'))
+  gauges['feeds'] = feeds.count()
+  gauges['feeds_due'] = feeds.filter(next_fetch_time__lte=now).count()
+  oldest_due = feeds.order_by('next_fetch_time').first()
+  gauges['feeds_overdue_seconds'] = max(
+      0.0, now - oldest_due.next_fetch_time) if oldest_due else 0.0
+
+  with db.connection.cursor() as cursor:
+    try:
+      cursor.execute(
+          'select name, sum(pgsize) from dbstat group by name order by name')
+    except db.OperationalError:
+      # SQLite built without the dbstat table.
+      pass
+    else:
+      for table, size in cursor.fetchall():
+        gauges['db_table_bytes{table="%s"}' % table] = size
+  gauges.update(response_cache.Stats())
+  for name in ('readability.db', 'huey.db', 'response_cache.db'):
+    try:
+      size = os.path.getsize(settings.DB_DIR / name)
+    except OSError:
+      continue
+    gauges['db_file_bytes{file="%s"}' % name] = size
+  return gauges
+
+
+async def Stats(request):
+  """Metrics from all processes, and gauges, as HTML, JSON or Prometheus."""
+  gauges = await _InThread(_Gauges)()
+  snapshot = await _InThread(task_queue.GatherMetrics)(HUEY)
+  output_format = request.GET.get('format')
+
+  if output_format == 'prometheus':
+    response = http.HttpResponse(metrics.PrometheusText(snapshot, gauges))
+    response['Content-Type'] = 'text/plain; version=0.0.4; charset=UTF-8'
+  elif output_format == 'json':
+    response = http.JsonResponse({
+        'gauges': gauges,
+        'metrics': dict(metrics.Rows(snapshot)),
+        })
+  else:
+    tpl = template.loader.get_template('stats.html')
+    stats = sorted(gauges.items()) + metrics.Rows(snapshot)
+    response = http.HttpResponse(tpl.render({'stats': stats}, request))
+  response['Cache-Control'] = 'no-cache'
+  return response
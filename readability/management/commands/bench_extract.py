@@ -0,0 +1,175 @@
+"""Benchmark extraction and munging over the saved page corpus, offline.
+
+Each page goes through `extract_content.ExtractFromHtml()` then
+`clean._Munge()`, as `clean._Clean()` does after fetching.  Reports latency
+percentiles per page and overall, pages per second, peak memory (from a
+separate traced run, so tracing doesn't skew the timings) and node counts.
+
+Usage:
+  python manage.py bench_extract --repeat 10 --save /tmp/before.json
+  ... change things ...
+  python manage.py bench_extract --repeat 10 --compare /tmp/before.json
+
+`--compare` exits non-zero if any page got slower than `--threshold`.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gc
+import json
+import math
+import platform
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from readability import clean
+from readability import corpus
+from readability import extract_content
+from readability import settings
+from readability import util
+
+# Slowdowns smaller than this many milliseconds are noise, whatever the ratio.
+_NOISE_FLOOR_MS = 1.0
+
+
+def _Percentile(sorted_values, fraction):
+  """Nearest-rank percentile."""
+  index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+  return sorted_values[index]
+
+
+def _CleanPage(page):
+  soup, tag = extract_content.ExtractFromHtml(page.url, page.html)
+  return clean._Munge(soup, tag, page.url)
+
+
+class Command(BaseCommand):
+  help = 'Benchmark extraction and munging over the saved page corpus.'
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+        '--repeat', type=int, default=5, help='Timed runs per page')
+    parser.add_argument(
+        '--page', action='append', dest='pages',
+        help='Only this corpus page; may be repeated')
+    parser.add_argument('--save', help='Write results as JSON to this file')
+    parser.add_argument(
+        '--compare', help='Compare against results saved by --save')
+    parser.add_argument(
+        '--threshold', type=float, default=0.15,
+        help='Fractional p50 slowdown, per page, counted as a regression')
+
+  def handle(self, *args, **options):
+    pages = corpus.Pages(options['pages'])
+    results = {
+        'pages': {},
+        'python': platform.python_version(),
+        'parser': settings.HTML_PARSER,
+        }
+    all_seconds = []
+    for page in pages:
+      result, seconds = self._BenchPage(page, options['repeat'])
+      results['pages'][page.name] = result
+      all_seconds.extend(seconds)
+    all_seconds.sort()
+    results['total'] = {
+        'pages_per_sec': round(len(all_seconds) / sum(all_seconds), 2),
+        'p50_ms': round(_Percentile(all_seconds, 0.5) * 1000, 3),
+        'p99_ms': round(_Percentile(all_seconds, 0.99) * 1000, 3),
+        }
+    self._Report(results)
+
+    if options['save']:
+      with open(options['save'], 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+      self.stdout.write('Saved: %s' % options['save'])
+    if options['compare']:
+      with open(options['compare']) as f:
+        baseline = json.load(f)
+      self._Compare(baseline, results, options['threshold'])
+
+  def _BenchPage(self, page, repeat):
+    # The first run warms up caches (e.g. compiled patterns, hyphenation).
+    _CleanPage(page)
+    gc.collect()
+    seconds = []
+    for unused_i in range(repeat):
+      start = time.perf_counter()
+      _CleanPage(page)
+      seconds.append(time.perf_counter() - start)
+    seconds.sort()
+
+    tracemalloc.start()
+    try:
+      _CleanPage(page)
+      unused_current, peak = tracemalloc.get_traced_memory()
+    finally:
+      tracemalloc.stop()
+
+    nodes = len(util.Soup(page.html).find_all(True))
+    return {
+        'bytes': len(page.html.encode('utf-8')),
+        'nodes': nodes,
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 3),
+        'p50_ms': round(_Percentile(seconds, 0.5) * 1000, 3),
+        'p99_ms': round(_Percentile(seconds, 0.99) * 1000, 3),
+        'peak_kib': round(peak / 1024),
+        }, seconds
+
+  def _Report(self, results):
+    row = '%-16s %9s %7s %10s %10s %10s'
+    self.stdout.write(row % (
+        'page', 'bytes', 'nodes', 'p50 ms', 'p99 ms', 'peak KiB'))
+    for name, result in results['pages'].items():
+      self.stdout.write(row % (
+          name, result['bytes'], result['nodes'], result['p50_ms'],
+          result['p99_ms'], result['peak_kib']))
+    total = results['total']
+    self.stdout.write(
+        'Overall: %(pages_per_sec)s pages/sec, p50 %(p50_ms)s ms, '
+        'p99 %(p99_ms)s ms' % total)
+
+  def _Compare(self, baseline, results, threshold):
+    regressions = []
+    row = '%-16s %10s %10s %8s %12s'
+    self.stdout.write('')
+    self.stdout.write(row % ('page', 'was p50', 'now p50', 'change', 'peak KiB'))
+    for name, result in results['pages'].items():
+      before = baseline['pages'].get(name)
+      if not before:
+        self.stdout.write(row % (name, '-', result['p50_ms'], 'new', '-'))
+        continue
+      change = result['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0
+      self.stdout.write(row % (
+          name, before['p50_ms'], result['p50_ms'], '%+.1f%%' % (change * 100),
+          '%s -> %s' % (before['peak_kib'], result['peak_kib'])))
+      if (change > threshold
+          and result['p50_ms'] - before['p50_ms'] > _NOISE_FLOOR_MS):
+        regressions.append(name)
+    if set(baseline['pages']) == set(results['pages']):
+      self.stdout.write('Overall pages/sec: %s -> %s' % (
+          baseline['total']['pages_per_sec'],
+          results['total']['pages_per_sec']))
+    if regressions:
+      raise CommandError(
+          'Slower by more than %d%%: %s'
+          % (threshold * 100, ', '.join(regressions)))
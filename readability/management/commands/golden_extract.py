@@ -0,0 +1,166 @@
+"""Check extraction of the saved page corpus against recorded golden output.
+
+For each corpus page, records which node was picked as best, the top scored
+nodes with their scores, and the final `clean._Munge()` output, in
+`testdata/golden/`.  Runs fully offline, so changes to scoring, patterns or
+munging can be checked to keep the current behavior.
+
+Usage:
+  python manage.py golden_extract            # Compare; fails on differences.
+  python manage.py golden_extract --bless    # Record the current output.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import difflib
+import json
+import math
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from readability import clean
+from readability import corpus
+from readability import extract_content
+from readability import settings
+from readability import util
+
+GOLDEN_DIR = corpus.CORPUS_DIR.parent / 'golden'
+
+# Lines of output diff to show per page.
+_MAX_DIFF_LINES = 40
+
+
+def _Record(page):
+  with extract_content.RecordPicks() as picks:
+    soup, tag = extract_content.ExtractFromHtml(page.url, page.html)
+  record = {'returned_node': util.NodePath(tag), 'picks': picks}
+  # Round trip through JSON, so tuples compare equal to recorded lists.
+  record = json.loads(json.dumps(record))
+  return record, clean._Munge(soup, tag, page.url)
+
+
+def _TagLines(html):
+  """Split HTML at tag boundaries, for a readable diff."""
+  return html.replace('>', '>\n').splitlines(keepends=True)
+
+
+class Command(BaseCommand):
+  help = 'Compare corpus extraction against golden output, or re-bless it.'
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+        '--bless', action='store_true',
+        help='Record the current output as golden')
+    parser.add_argument(
+        '--page', action='append', dest='pages',
+        help='Only this corpus page; may be repeated')
+    parser.add_argument(
+        '--rel-tolerance', type=float, default=1e-6,
+        help='Relative difference allowed in scores')
+    parser.add_argument(
+        '--abs-tolerance', type=float, default=1e-9,
+        help='Absolute difference allowed in scores')
+
+  def handle(self, *args, **options):
+    if util.DEBUG:
+      raise CommandError('DEBUG changes extraction output; run without it.')
+    # Output mustn't depend on how fast this machine is.
+    settings.EXTRACT_MAX_SECONDS = 0
+
+    failed = []
+    for page in corpus.Pages(options['pages']):
+      record, output = _Record(page)
+      json_path = GOLDEN_DIR / (page.name + '.json')
+      html_path = GOLDEN_DIR / (page.name + '.html')
+
+      if options['bless']:
+        GOLDEN_DIR.mkdir(exist_ok=True)
+        with open(json_path, 'w') as f:
+          json.dump(record, f, indent=1)
+          f.write('\n')
+        with open(html_path, 'w', encoding='utf-8') as f:
+          f.write(output)
+        self.stdout.write('Blessed %s' % page.name)
+        continue
+
+      try:
+        with open(json_path) as f:
+          golden_record = json.load(f)
+        with open(html_path, encoding='utf-8') as f:
+          golden_output = f.read()
+      except FileNotFoundError:
+        self.stdout.write('%s: no golden output; run with --bless' % page.name)
+        failed.append(page.name)
+        continue
+
+      problems = self._CompareRecords(golden_record, record, options)
+      if output != golden_output:
+        problems.append('munged output differs:')
+        diff = list(difflib.unified_diff(
+            _TagLines(golden_output), _TagLines(output), 'golden', 'now'))
+        problems.extend(line.rstrip('\n') for line in diff[:_MAX_DIFF_LINES])
+        if len(diff) > _MAX_DIFF_LINES:
+          problems.append('... %d more lines' % (len(diff) - _MAX_DIFF_LINES))
+
+      if problems:
+        failed.append(page.name)
+        self.stdout.write('FAIL %s' % page.name)
+        for problem in problems:
+          self.stdout.write('  ' + problem)
+      else:
+        self.stdout.write('ok   %s' % page.name)
+
+    if failed:
+      raise CommandError(
+          'Differs from golden output: %s.  If intended, re-run with --bless.'
+          % ', '.join(failed))
+
+  def _CompareRecords(self, golden, now, options):
+    problems = []
+    if golden['returned_node'] != now['returned_node']:
+      problems.append('returned node: %s, was %s' % (
+          now['returned_node'], golden['returned_node']))
+    if len(golden['picks']) != len(now['picks']):
+      problems.append('%d picks, was %d' % (
+          len(now['picks']), len(golden['picks'])))
+      return problems
+
+    for golden_pick, pick in zip(golden['picks'], now['picks']):
+      if golden_pick['best_node'] != pick['best_node']:
+        problems.append('best node: %s, was %s' % (
+            pick['best_node'], golden_pick['best_node']))
+      golden_nodes = golden_pick['scored_nodes']
+      nodes = pick['scored_nodes']
+      if [path for path, _ in golden_nodes] != [path for path, _ in nodes]:
+        problems.append('scored nodes differ:')
+        problems.extend(
+            '  ' + line for line in difflib.unified_diff(
+                ['%s %r' % tuple(node) for node in golden_nodes],
+                ['%s %r' % tuple(node) for node in nodes],
+                'golden', 'now', lineterm=''))
+        continue
+      for (path, golden_score), (unused_path, score) in zip(
+          golden_nodes, nodes):
+        if not math.isclose(
+            golden_score, score, rel_tol=options['rel_tolerance'],
+            abs_tol=options['abs_tolerance']):
+          problems.append('score of %s: %r, was %r' % (
+              path, score, golden_score))
+    return problems
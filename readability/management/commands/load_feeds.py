@@ -0,0 +1,219 @@
+"""Load test feed ingestion end to end, against a local replay origin.
+
+Subscribes synthetic feeds served by `replay_origin.ReplayOrigin`, runs a Huey
+consumer in this process to clean their entries, and reports throughput,
+queue lag and database write rate until every entry is stored.  Then, for
+`--updates` rounds, adds entries to every feed and updates them all.  Uses a
+temporary database, task queue and response cache; nothing leaves this
+machine.
+
+With `--redirects N`, every page redirects (302) N times first, setting a
+cookie each hop that later hops require.  The run then fails if any chain was
+stored, as temporary redirects must not be.  With `--permanent-redirects` too,
+they are 301s without cookies, and the run fails unless each page's chain was
+followed and stored by `util.Fetch()`, and a fetch of a stored URL skips
+straight to its page.
+
+Usage:
+  python manage.py load_feeds --feeds 20 --entries 10 --workers 8 --latency 0.2
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures
+import pathlib
+import signal
+import tempfile
+import time
+
+from django import db
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.test import utils as test_utils
+from huey.contrib.djhuey import HUEY
+
+from readability import feed
+from readability import models
+from readability import redirects
+from readability import replay_origin
+from readability import settings
+from readability import task_queue
+from readability import util
+
+# Seconds between progress samples.
+_SAMPLE_INTERVAL = 1.0
+
+
+class Command(BaseCommand):
+  help = 'Load test feed subscription and update against a local origin.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--feeds', type=int, default=20)
+    parser.add_argument(
+        '--entries', type=int, default=10, help='Initial entries per feed')
+    parser.add_argument('--workers', type=int, default=8, help='Huey workers')
+    parser.add_argument(
+        '--subscribers', type=int, default=8,
+        help='Threads subscribing feeds concurrently')
+    parser.add_argument(
+        '--latency', type=float, default=0.2,
+        help='Seconds the origin waits before each response')
+    parser.add_argument(
+        '--redirects', type=int, default=0,
+        help='Redirects before each page is served')
+    parser.add_argument(
+        '--permanent-redirects', action='store_true',
+        help='Make those redirects permanent (301), not temporary (302)')
+    parser.add_argument(
+        '--error-rate', type=float, default=0.0,
+        help='Fraction of origin responses which are 500 errors')
+    parser.add_argument(
+        '--updates', type=int, default=1,
+        help='Rounds of new entries and feed updates after subscribing')
+    parser.add_argument(
+        '--timeout', type=float, default=600,
+        help='Give up waiting for entries after this many seconds')
+
+  def handle(self, *args, **options):
+    temp_dir = pathlib.Path(tempfile.mkdtemp())
+    # Keep this run's response cache and tasks out of the real ones.
+    settings.DB_DIR = temp_dir
+    HUEY.immediate = False
+    HUEY.storage_kwargs['filename'] = str(temp_dir / 'huey.db')
+    HUEY.storage = HUEY.create_storage()
+    test_utils.setup_test_environment()
+    old_config = test_utils.setup_databases(verbosity=0, interactive=False)
+
+    origin = replay_origin.ReplayOrigin(
+        latency=options['latency'], error_rate=options['error_rate'])
+    link_query = ''
+    if options['redirects']:
+      link_query = 'redirects=%d' % options['redirects']
+      if options['permanent_redirects']:
+        link_query += '&permanent=1'
+    origin.AddFeeds(options['feeds'], options['entries'], link_query)
+    origin.Start()
+
+    consumer = HUEY.create_consumer(
+        workers=options['workers'], worker_type='thread', periodic=False,
+        check_worker_health=False)
+    # The consumer's signal handlers expect its own run loop; keep ours.
+    old_handlers = {
+        sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    consumer.start()
+    for sig, handler in old_handlers.items():
+      signal.signal(sig, handler)
+
+    try:
+      self._Subscribe(origin.FeedUrls(), options['subscribers'])
+      # Only the newest entries of each feed are kept.
+      per_feed = min(options['entries'], models.MAX_ENTRIES_PER_FEED)
+      expected = options['feeds'] * per_feed
+      self._WaitForEntries('Initial entries', expected, options['timeout'])
+      for unused_round in range(options['updates']):
+        origin.AdvanceFeeds(options['entries'])
+        expected += options['feeds'] * per_feed
+        for url in origin.FeedUrls():
+          feed.UpdateFeed(url)
+        self._WaitForEntries('Updated entries', expected, options['timeout'])
+      self.stdout.write('Origin requests: %d' % origin.requests)
+      if options['redirects']:
+        self._CheckRedirects(
+            origin, options['redirects'], options['permanent_redirects'])
+    finally:
+      consumer.stop(graceful=True)
+      origin.Stop()
+      test_utils.teardown_databases(old_config, verbosity=0)
+
+  def _Subscribe(self, feed_urls, subscribers):
+    def subscribe(url):
+      db.close_old_connections()
+      try:
+        feed.CreateFeed(url)
+      finally:
+        db.close_old_connections()
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(subscribers) as pool:
+      list(pool.map(subscribe, feed_urls))
+    elapsed = time.perf_counter() - start
+    self.stdout.write('Subscribed %d feeds in %.2fs: %.1f feeds/sec' % (
+        len(feed_urls), elapsed, len(feed_urls) / elapsed))
+
+  def _CheckRedirects(self, origin, hops, permanent):
+    """Check that page fetches followed, stored, and then skip redirects.
+
+    Only permanent ones; temporary ones must not be stored at all.
+    """
+    stored = models.Redirect.objects.all()
+    if not permanent:
+      if stored:
+        raise CommandError(
+            'Redirects: %d temporary chains stored.' % len(stored))
+      self.stdout.write('Redirects: temporary chains not stored.')
+      return
+    if not stored:
+      raise CommandError('Redirects: none stored.')
+    partial = stored.exclude(hops=hops).count()
+    if partial:
+      raise CommandError(
+          'Redirects: %d of %d stored with other than %d hops.'
+          % (partial, len(stored), hops))
+    before = origin.requests
+    response, unused_final_url = util.Fetch(
+        stored[0].url, do_cache=False,
+        redirect_cache=redirects.RedirectCache())
+    if origin.requests - before != 1 or response.status_code != 200:
+      raise CommandError(
+          'Redirects: fetch of a stored URL made %d requests, got status %d.'
+          % (origin.requests - before, response.status_code))
+    self.stdout.write(
+        'Redirects: %d stored; a stored URL is fetched in one request.'
+        % len(stored))
+
+  def _WaitForEntries(self, name, expected, timeout):
+    start = time.perf_counter()
+    initial = models.Entry.objects.count()
+    stored = initial
+    max_lag = 0.0
+    previous, previous_time = stored, start
+    while stored < expected:
+      elapsed = time.perf_counter() - start
+      if elapsed > timeout:
+        raise CommandError(
+            '%s: timed out with %d of %d entries stored.'
+            % (name, stored, expected))
+      time.sleep(_SAMPLE_INTERVAL)
+      stored = models.Entry.objects.count()
+      stats = task_queue.Stats(HUEY)
+      max_lag = max(max_lag, stats['lag_seconds'] or 0.0)
+      now = time.perf_counter()
+      self.stdout.write(
+          '  %6.1fs: %d/%d entries, %.1f writes/sec, %d pending, '
+          '%d scheduled, lag %.1fs' % (
+              now - start, stored, expected,
+              (stored - previous) / (now - previous_time), stats['pending'],
+              stats['scheduled'], stats['lag_seconds'] or 0.0))
+      previous, previous_time = stored, now
+
+    elapsed = time.perf_counter() - start
+    self.stdout.write(
+        '%s: %d stored in %.2fs: %.1f entries/sec; max queue lag %.1fs' % (
+            name, stored - initial, elapsed, (stored - initial) / elapsed,
+            max_lag))
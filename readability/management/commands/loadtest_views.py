@@ -0,0 +1,133 @@
+"""Load test /page, synchronous (WSGI) against asynchronous (ASGI) serving.
+
+Starts a local stand-in origin which answers every request slowly, then
+cleans the same number of its pages both through a fixed pool of WSGI worker
+threads, and concurrently through the ASGI handler.  Nothing leaves this
+machine, and the response cache is kept in a temporary directory.
+
+Usage:
+  python manage.py loadtest_views --requests 200 --latency 1 --workers 8
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import concurrent.futures
+import http.server
+import pathlib
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from django.core.management.base import BaseCommand
+from django import test
+from django.test import utils as test_utils
+
+from readability import settings
+
+
+_PAGE = '''<html><head><title>Stand-in article %(n)d</title></head>
+<body><div class="nav"><a href="/">Home</a></div>
+<div class="article"><h1>Stand-in article number %(n)d</h1>
+%(paragraphs)s
+</div></body></html>'''
+_PARAGRAPH = (
+    '<p>Readers subscribe to feeds which link to articles elsewhere, and '
+    'this paragraph stands in for the body of one of those articles.</p>')
+
+
+class _SlowOriginHandler(http.server.BaseHTTPRequestHandler):
+  latency = 1.0
+
+  def do_GET(self):
+    time.sleep(self.latency)
+    n = int(urllib.parse.parse_qs(
+        urllib.parse.urlparse(self.path).query).get('n', ['0'])[0])
+    body = _PAGE % {'n': n, 'paragraphs': _PARAGRAPH * 20}
+    body = body.encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/html; charset=utf-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *unused_args):
+    pass
+
+
+class Command(BaseCommand):
+  help = 'Compare /page throughput under WSGI threads and the ASGI handler.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument(
+        '--latency', type=float, default=1.0,
+        help='Seconds the origin waits before each response.')
+    parser.add_argument(
+        '--workers', type=int, default=8,
+        help='WSGI worker threads, as a typical deployment would have.')
+
+  def handle(self, *args, **options):
+    test_utils.setup_test_environment()
+    # Keep the response cache of this run out of the real one.
+    settings.DB_DIR = pathlib.Path(tempfile.mkdtemp())
+
+    _SlowOriginHandler.latency = options['latency']
+    origin = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), _SlowOriginHandler)
+    origin.daemon_threads = True
+    threading.Thread(target=origin.serve_forever, daemon=True).start()
+    origin_url = 'http://127.0.0.1:%d/article' % origin.server_address[1]
+
+    count = options['requests']
+    # Distinct URLs per run, so neither run is served from the cache.
+    wsgi_urls = ['%s?run=wsgi&n=%d' % (origin_url, i) for i in range(count)]
+    asgi_urls = ['%s?run=asgi&n=%d' % (origin_url, i) for i in range(count)]
+
+    elapsed = self._RunWsgi(wsgi_urls, options['workers'])
+    self._Report('WSGI, %d threads' % options['workers'], count, elapsed)
+    elapsed = asyncio.run(self._RunAsgi(asgi_urls))
+    self._Report('ASGI, one event loop', count, elapsed)
+    origin.shutdown()
+
+  def _RunWsgi(self, urls, workers):
+    client = test.Client()
+    def get(url):
+      response = client.get('/page', {'url': url})
+      assert response.status_code == 200, response.status_code
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+      list(pool.map(get, urls))
+    return time.perf_counter() - start
+
+  async def _RunAsgi(self, urls):
+    client = test.AsyncClient()
+    async def get(url):
+      response = await client.get('/page', {'url': url})
+      assert response.status_code == 200, response.status_code
+
+    start = time.perf_counter()
+    await asyncio.gather(*[get(url) for url in urls])
+    return time.perf_counter() - start
+
+  def _Report(self, name, count, elapsed):
+    self.stdout.write('%-24s %5d requests in %7.2fs: %7.1f requests/sec' % (
+        name, count, elapsed, count / elapsed))
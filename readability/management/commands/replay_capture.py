@@ -0,0 +1,130 @@
+"""Re-run extraction on captured slow or failed cleans, offline.
+
+Reads capture directories saved by `readability.capture`, decodes each body
+as it was when captured, and runs `extract_content.ExtractFromHtml()` then
+`clean._Munge()`, optionally under the profiler.  A capture can be added to
+the benchmark corpus.  Cleans which took the feed path are replayed through
+HTML extraction, which needs no network.
+
+Usage:
+  python manage.py replay_capture $CAPTURE_DIR/*
+  python manage.py replay_capture --profile $CAPTURE_DIR/1700000000000-12-host
+  python manage.py replay_capture --add-to-corpus slow_host DIR
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import pathlib
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from readability import clean
+from readability import corpus
+from readability import extract_content
+from readability import profiling
+
+
+def _ExtractAndMunge(url, html):
+  soup, tag = extract_content.ExtractFromHtml(url, html)
+  return clean._Munge(soup, tag, url)
+
+
+class Command(BaseCommand):
+  help = 'Re-run extraction of captured slow or failed cleans.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('captures', nargs='+', help='Capture directories')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Print a profile of each extraction')
+    parser.add_argument(
+        '--top', type=int, default=profiling.TOP_FUNCTIONS,
+        help='Functions to list in each profile')
+    parser.add_argument(
+        '--output', action='store_true', help='Print the munged output')
+    parser.add_argument(
+        '--add-to-corpus', metavar='NAME',
+        help='Add the (single) capture to the benchmark corpus as NAME')
+
+  def handle(self, *args, **options):
+    if options['add_to_corpus'] and len(options['captures']) != 1:
+      raise CommandError('--add-to-corpus takes exactly one capture.')
+
+    for capture_dir in options['captures']:
+      capture_dir = pathlib.Path(capture_dir)
+      try:
+        with open(capture_dir / 'meta.json') as f:
+          meta = json.load(f)
+        with open(capture_dir / 'body', 'rb') as f:
+          body = f.read()
+      except FileNotFoundError as e:
+        raise CommandError('Not a capture: %s (%s)' % (capture_dir, e))
+      try:
+        html = body.decode(meta.get('encoding') or 'utf-8', 'replace')
+      except LookupError:
+        # Pages can declare charsets Python doesn't know.
+        html = body.decode('utf-8', 'replace')
+      url = meta.get('final_url') or meta['url']
+
+      self.stdout.write('%s: %s' % (capture_dir.name, url))
+      self.stdout.write('  captured: %.2fs, %s' % (
+          meta.get('seconds', 0), meta.get('error') or 'no error'))
+      self.stdout.write('  timings then: %s' % ' '.join(
+          '%s=%s' % item for item in meta.get('timings', {}).items()))
+
+      if options['profile']:
+        output, report = profiling.Profile(
+            url, _ExtractAndMunge, url, html, top=options['top'])
+        self.stdout.write(report)
+      else:
+        start = time.perf_counter()
+        output = _ExtractAndMunge(url, html)
+        self.stdout.write('  now: %.3fs' % (time.perf_counter() - start))
+      if options['output']:
+        self.stdout.write(output)
+
+      if options['add_to_corpus']:
+        self._AddToCorpus(options['add_to_corpus'], url, html, meta)
+
+  def _AddToCorpus(self, name, url, html, meta):
+    manifest_path = corpus.CORPUS_DIR / 'manifest.json'
+    with open(manifest_path) as f:
+      manifest = json.load(f)
+    if any(entry['name'] == name for entry in manifest):
+      raise CommandError('Corpus already has a page named %r.' % name)
+
+    file_name = name + '.html'
+    with open(corpus.CORPUS_DIR / file_name, 'w', encoding='utf-8') as f:
+      f.write(html)
+    manifest.append({
+        'name': name,
+        'file': file_name,
+        'url': url,
+        'description': 'Captured clean: %.2fs, %s.' % (
+            meta.get('seconds', 0), meta.get('error') or 'slow'),
+        })
+    with open(manifest_path, 'w') as f:
+      json.dump(manifest, f, indent=2)
+      f.write('\n')
+    self.stdout.write(
+        'Added %s to the corpus; record its golden output with '
+        '`manage.py golden_extract --bless --page %s`.' % (name, name))
@@ -0,0 +1,207 @@
+"""Process-wide counters and latency histograms.
+
+Recording is a dict update under one lock, cheap enough for every fetch and
+every clean, from web threads and task queue workers alike.  Each process
+keeps its own; `task_queue.PublishMetrics()` shares them between processes.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bisect
+import threading
+
+
+# Name: (help text, label names).
+METRICS = {
+    'clean_total': (
+        'Pages cleaned, by result and path taken.', ('result', 'path')),
+    'feed_extract_total': (
+        'Attempts to extract a page from its feed, by RssError raised.',
+        ('outcome',)),
+    'fetch_total': (
+        'HTTP requests (not cache hits), per redirect hop, by host.',
+        ('host',)),
+    'fetch_seconds': ('HTTP request latency, by host.', ('host',)),
+    'fetch_bytes_total': (
+        'Bytes of response bodies received (before decoding), by host of the '
+        'last hop.', ('host',)),
+    'cache_total': ('Cache lookups, by cache and result.', ('cache', 'result')),
+    'response_cache_bytes_total': (
+        'Compressed bytes of responses stored in, or served from, the cache.',
+        ('direction',)),
+    'response_cache_evictions_total': (
+        'Responses deleted from the cache, by reason.', ('reason',)),
+    'redirect_hops_saved_total': (
+        'HTTP requests skipped by starting from a cached redirect.', ()),
+    'stage_seconds': ('Clean pipeline stage latency.', ('stage',)),
+    'extract_mode_total': (
+        'Cleans switched to a cheaper mode, by mode and limit exceeded.',
+        ('mode', 'reason')),
+    }
+# Upper bounds, in seconds, of histogram buckets.  The last is unbounded.
+BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, float('inf'))
+# Past this many values for one label of one metric, record 'other'.
+MAX_LABEL_VALUES = 200
+
+_LOCK = threading.Lock()
+_COUNTERS = {}
+_HISTOGRAMS = {}
+_LABEL_VALUES = {}
+
+
+def _Key(name, labels):
+  seen = _LABEL_VALUES.setdefault(name, set())
+  if labels not in seen:
+    if len(seen) >= MAX_LABEL_VALUES:
+      return (name, ('other',) * len(labels))
+    seen.add(labels)
+  return (name, labels)
+
+
+def Inc(name, labels=(), value=1):
+  with _LOCK:
+    key = _Key(name, labels)
+    _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+
+def Observe(name, seconds, labels=()):
+  with _LOCK:
+    key = _Key(name, labels)
+    try:
+      histogram = _HISTOGRAMS[key]
+    except KeyError:
+      # A count per bucket, then the sum of all observations.
+      histogram = _HISTOGRAMS[key] = [0] * len(BUCKETS) + [0.0]
+    histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+    histogram[-1] += seconds
+
+
+def ObserveTimings(timings):
+  """Record each stage of a `timing.Timings`."""
+  for stage, (unused_count, seconds) in timings.stages.items():
+    Observe('stage_seconds', seconds, (stage,))
+
+
+def Snapshot():
+  """Return a picklable copy of this process's metrics."""
+  with _LOCK:
+    return {
+        'counters': dict(_COUNTERS),
+        'histograms': {k: list(v) for k, v in _HISTOGRAMS.items()},
+        }
+
+
+def Merge(snapshots):
+  """Sum several snapshots, e.g. from different processes, into one."""
+  merged = {'counters': {}, 'histograms': {}}
+  for snapshot in snapshots:
+    for key, value in snapshot['counters'].items():
+      merged['counters'][key] = merged['counters'].get(key, 0) + value
+    for key, histogram in snapshot['histograms'].items():
+      total = merged['histograms'].setdefault(key, [0] * len(histogram))
+      for i, value in enumerate(histogram):
+        total[i] += value
+  return merged
+
+
+def Percentile(histogram, fraction):
+  """Estimate a percentile from a histogram, interpolating within buckets."""
+  counts = histogram[:-1]
+  target = fraction * sum(counts)
+  if not target:
+    return None
+  seen = 0
+  for i, count in enumerate(counts):
+    if count and seen + count >= target:
+      lower = BUCKETS[i - 1] if i else 0.0
+      upper = BUCKETS[i] if i < len(BUCKETS) - 1 else lower
+      return lower + (upper - lower) * (target - seen) / count
+    seen += count
+
+
+def _LabelText(name, labels):
+  if not labels:
+    return ''
+  return '{%s}' % ','.join(
+      '%s="%s"' % (label_name, str(value).replace('"', '\\"'))
+      for label_name, value in zip(METRICS[name][1], labels))
+
+
+def Rows(snapshot):
+  """Flatten a snapshot to sorted (name, value) pairs, for people to read."""
+  rows = []
+  for (name, labels), value in snapshot['counters'].items():
+    rows.append((name + _LabelText(name, labels), value))
+  for (name, labels), histogram in snapshot['histograms'].items():
+    label_text = _LabelText(name, labels)
+    rows.append((name + '_count' + label_text, sum(histogram[:-1])))
+    for fraction in (0.5, 0.9, 0.99):
+      percentile = Percentile(histogram, fraction)
+      if percentile is not None:
+        rows.append(('%s_p%d%s' % (name, fraction * 100, label_text),
+                     round(percentile, 4)))
+  return sorted(rows)
+
+
+def PrometheusText(snapshot, gauges):
+  """Format a snapshot, plus a dict of gauge name to value, for Prometheus.
+
+  Gauge names may carry their own labels, as in 'name{label="value"}'.
+  """
+  lines = []
+  by_name = {}
+  for (name, labels), value in snapshot['counters'].items():
+    by_name.setdefault(name, []).append((labels, value))
+  for (name, labels), histogram in snapshot['histograms'].items():
+    by_name.setdefault(name, []).append((labels, histogram))
+
+  for name in sorted(by_name):
+    help_text, unused_label_names = METRICS[name]
+    is_histogram = name in {k[0] for k in snapshot['histograms']}
+    lines.append('# HELP readability_%s %s' % (name, help_text))
+    lines.append('# TYPE readability_%s %s' % (
+        name, 'histogram' if is_histogram else 'counter'))
+    for labels, value in sorted(by_name[name]):
+      label_text = _LabelText(name, labels)
+      if not is_histogram:
+        lines.append('readability_%s%s %s' % (name, label_text, value))
+        continue
+      cumulative = 0
+      for bound, count in zip(BUCKETS, value[:-1]):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        bucket_labels = (label_text[:-1] + ',' if label_text else '{')
+        lines.append('readability_%s_bucket%sle="%s"} %d' % (
+            name, bucket_labels, le, cumulative))
+      lines.append('readability_%s_sum%s %s' % (name, label_text, value[-1]))
+      lines.append('readability_%s_count%s %d' % (
+          name, label_text, cumulative))
+
+  typed = set()
+  for name, value in sorted(gauges.items()):
+    if value is None:
+      continue
+    base_name = name.split('{')[0]
+    if base_name not in typed:
+      typed.add(base_name)
+      lines.append('# TYPE readability_%s gauge' % base_name)
+    lines.append('readability_%s %s' % (name, value))
+  return '\n'.join(lines) + '\n'
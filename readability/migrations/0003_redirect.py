@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-19 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readability', '0002_auto_20210407_1841'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Redirect',
+            fields=[
+                ('url', models.TextField(primary_key=True, serialize=False)),
+                ('final_url', models.TextField()),
+                ('cookie', models.TextField(blank=True, default='')),
+                ('hops', models.IntegerField()),
+                ('expire_time', models.FloatField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-19 13:05
+
+from django.db import migrations
+
+
+def _DeleteRedirects(apps, unused_schema_editor):
+    # Stored before only permanent chains were: some may be temporary.
+    apps.get_model('readability', 'Redirect').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('readability', '0003_redirect'),
+    ]
+
+    operations = [
+        migrations.RunPython(_DeleteRedirects, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='redirect',
+            name='cookie',
+        ),
+    ]
@@ -68,3 +68,14 @@ class Entry(models.Model):
   content = models.TextField(blank=False, default=None)
   original_content = models.TextField()
   tags = models.JSONField(default=list)
+
+
+class Redirect(models.Model):
+  """Where a URL last redirected to.  See `readability.redirects`."""
+  class Meta:
+    app_label = 'readability'
+
+  url = models.TextField(primary_key=True)
+  final_url = models.TextField()
+  hops = models.IntegerField()
+  expire_time = models.FloatField(db_index=True)  # UTC seconds.
@@ -27,12 +27,21 @@ import urllib.error
 import urllib.parse
 import urllib.request
 
+import bs4
+
+from readability import budget
+from readability import metrics
+from readability import settings
 from readability import util
 
 # If one pattern matched this many tags, consider it a false positive, and
 # subtract its points back out.
 FALSE_POSITIVE_THRESHOLD = 15
 
+# (class, id) -> "classid": their words, as `_ClassId()` makes them.  Shared by
+# every page; emptied when it reaches CLASSID_CACHE_SIZE.
+_CLASSIDS = {}
+
 
 def _ReAny(pattern):
   return re.compile(pattern, re.I)
@@ -269,12 +278,33 @@ def _SeparateWords(s):
   return s.lower()
 
 
+def _ClassId(tag, counts):
+  """A single "class and id" string that the 'classid' patterns test.
+
+  Pages repeat the same few class lists on many tags, so each distinct pair
+  is only separated into words once.  `counts` is [hits, misses], to update.
+  """
+  key = (' '.join(tag.get('class', [])), tag.get('id', ''))
+  classid = _CLASSIDS.get(key)
+  if classid is not None:
+    counts[0] += 1
+    return classid
+  counts[1] += 1
+  classid = '!!!'.join([
+      _SeparateWords(key[0]).strip(), _SeparateWords(key[1]).strip()
+      ]).strip('!')
+  if len(_CLASSIDS) >= settings.CLASSID_CACHE_SIZE:
+    _CLASSIDS.clear()
+  _CLASSIDS[key] = classid
+  return classid
+
+
 def _FindPreviousHeader(tag):
   # Find the "header" immediately previous to this tag.  Search among a few
   # possibilities for it.
 
   # If tag, and nothing else, is wrapped by e.g. a <div>, pop up.
-  while len(tag.parent.findAll(name=True, recursive=False)) == 1:
+  while tag.parent is not None and _IsOnlyChildTag(tag):
     tag = tag.parent
 
   # First, try the immediately previous sibling node, skipping breaks.
@@ -288,6 +318,14 @@ def _FindPreviousHeader(tag):
   return (None, '')
 
 
+def _IsOnlyChildTag(tag):
+  """Whether tag is its parent's only child tag (ignoring text)."""
+  for sibling in tag.parent.children:
+    if sibling is not tag and isinstance(sibling, bs4.Tag):
+      return False
+  return True
+
+
 def _IsLeafBlock(tag):
   if tag.name not in util.TAG_NAMES_BLOCK:
     return False
@@ -300,7 +338,7 @@ def _IsList(tag):
   if tag.name == 'ul': return True
   if tag.name == 'ol': return True
   if 'blockquote' == tag.name:
-    if re.search(r'(<br.*?> - .*){2,}', str(tag)):
+    if _HasDashedLines(tag):
       return True
   if 'center' == tag.name:
     tags_links = tag.findAll(name='a', recursive=False)
@@ -309,6 +347,28 @@ def _IsList(tag):
   return False
 
 
+def _HasDashedLines(tag):
+  """Whether tag has two "<br> ... - " lines, with no newline between them.
+
+  That is: a <br>, then text starting " - " after it, twice, all in one line
+  of source.  Checked on the tree, without serializing it.
+  """
+  # Which of <br>, dash, <br>, dash has been seen last, in this line.
+  seen = 0
+  for node in tag.descendants:
+    if isinstance(node, bs4.Tag):
+      if node.name == 'br' and seen in (0, 2):
+        seen += 1
+      continue
+    if seen in (1, 3) and node.startswith(' - '):
+      seen += 1
+      if seen == 4:
+        return True
+    if '\n' in node:
+      seen = 0
+  return False
+
+
 def _Score(tag, url, hit_counter):
   if tag.name == 'body': return
 
@@ -318,6 +378,8 @@ def _Score(tag, url, hit_counter):
     util.ApplyScore(tag, 1, name='section_tag')
 
   # Point patterns.
+  # TODO: `attr in tag` tests children, not attributes, so none of these (nor
+  # ATTR_STRIP's) ever match.  Fixing that changes picks; do it on its own.
   for points, attr, pattern in ATTR_POINTS:
     if attr not in tag: continue
     if pattern.search(tag[attr]):
@@ -388,7 +450,7 @@ def _Strip(tag):
 
   if tag.name in STRIP_TAGS:
     if tag.name == 'form':
-      if 'aspnetForm' in [attr[1] for attr in tag.attrs]: return False
+      if 'aspnetForm' in tag.attrs.values(): return False
       if tag.find('input', id='__VIEWSTATE'): return False
     if tag.name == 'iframe' and tag.has_attr('score_has_embed'):
       return False
@@ -448,34 +510,35 @@ def _TextLen(tag):
   return len(text)
 
 
-def Process(root_tag, url, hit_counter=None):
-  """Process an entire soup, without recursing into stripped nodes."""
-  # Make a single "class and id" attribute that everything else can test.
-  root_tag['classid'] = '!!!'.join([
-      _SeparateWords(' '.join(root_tag.get('class', []))).strip(),
-      _SeparateWords(root_tag.get('id', '')).strip()
-      ]).strip('!')
+def Process(root_tag, url):
+  """Process an entire soup, without descending into stripped nodes."""
+  hit_counter = {}
+  counts = [0, 0]
 
-  top_run = False
-  if hit_counter is None:
-    hit_counter = {}
-    top_run = True
+  # Depth first, in document order, with a stack rather than recursion: deeply
+  # nested documents must not hit the recursion limit.
+  stack = [root_tag]
+  while stack:
+    tag = stack.pop()
+    budget.Check()
+    # Make a single "class and id" attribute that everything else can test.
+    tag['classid'] = _ClassId(tag, counts)
 
-  _Score(root_tag, url, hit_counter)
-  if _Strip(root_tag): return
-  for tag in root_tag.findAll(True, recursive=False):
-    Process(tag, url, hit_counter)
+    _Score(tag, url, hit_counter)
+    if _Strip(tag): continue
+    stack.extend(reversed(tag.findAll(True, recursive=False)))
+  metrics.Inc('cache_total', ('classid', 'hit'), counts[0])
+  metrics.Inc('cache_total', ('classid', 'miss'), counts[1])
 
   # Look for too-frequently-matched false-positive patterns.
-  if top_run:
-    for key, tags in hit_counter.items():
-      if len(tags) >= FALSE_POSITIVE_THRESHOLD:
-        points, attr, unused_pattern = key
-        if points < 0:
-          # Only reverse false _positives_.  Negatives probably aren't false.
-          continue
-        util.log.info(
-            'Undoing %d points for %d tags, with %s matching %s',
-            points, len(tags), attr, unused_pattern)
-        for tag in tags:
-          util.ApplyScore(tag, -1 * points, name=attr)
+  for key, tags in hit_counter.items():
+    if len(tags) >= FALSE_POSITIVE_THRESHOLD:
+      points, attr, unused_pattern = key
+      if points < 0:
+        # Only reverse false _positives_.  Negatives probably aren't false.
+        continue
+      util.log.info(
+          'Undoing %d points for %d tags, with %s matching %s',
+          points, len(tags), attr, unused_pattern)
+      for tag in tags:
+        util.ApplyScore(tag, -1 * points, name=attr)
@@ -0,0 +1,79 @@
+"""Profile one clean or extraction, to see why a particular page is slow.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import re
+import time
+
+from readability import settings
+from readability import timing
+
+# Functions listed in a report, by cumulative time.
+TOP_FUNCTIONS = 40
+
+
+def Allowed(value):
+  """Whether a request's `profile` parameter value may turn on profiling.
+
+  Profiling is for operators only: with DEBUG any true value works, otherwise
+  the value must match the PROFILE_TOKEN setting, and never when it's unset.
+  """
+  if not value:
+    return False
+  if settings.DEBUG:
+    return True
+  if not settings.PROFILE_TOKEN:
+    return False
+  # As bytes: compare_digest() takes only ASCII str, and any value may come in.
+  return hmac.compare_digest(
+      value.encode('utf-8'), settings.PROFILE_TOKEN.encode('utf-8'))
+
+
+def Profile(name, func, *args, top=TOP_FUNCTIONS):
+  """Call `func(*args)` under cProfile, in this thread.
+
+  If the PROFILE_DIR setting is set, the raw profile is also saved there, for
+  `python -m pstats` or other viewers.
+
+  Returns:
+    Tuple of (func's result, text report of the stage timings and the `top`
+    functions by cumulative time).
+  """
+  profiler = cProfile.Profile()
+  with timing.Collect() as timings:
+    result = profiler.runcall(func, *args)
+
+  out = io.StringIO()
+  out.write('Profile of %s\n' % name)
+  out.write('Timings: %s\n' % timings)
+  if settings.PROFILE_DIR:
+    path = os.path.join(settings.PROFILE_DIR, '%d-%s.prof' % (
+        time.time(), re.sub(r'[^\w.-]+', '_', name)[:100]))
+    profiler.dump_stats(path)
+    out.write('Saved: %s\n' % path)
+  out.write('\n')
+  stats = pstats.Stats(profiler, stream=out)
+  stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+  return result, out.getvalue()
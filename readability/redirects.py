@@ -0,0 +1,79 @@
+"""Remember where URLs redirect to, to skip the redirects next time.
+
+Feeds link through shorteners and trackers (feedproxy, t.co, bit.ly, ...)
+that always redirect to the same page.  When `util.Fetch()` follows a chain
+of only permanent (301, 308) redirects, the (cleaned) first URL is stored with
+the final one for REDIRECT_CACHE_SECONDS.  Later fetches of it start at the
+final URL.  If it redirects again by then, the chain is followed, and stored
+anew if permanent, from there.  Temporary redirects may lead elsewhere next
+time, and cookies set along the way may be per session; neither is stored.
+
+Lookups count in `cache_total{cache="redirect"}`, and the requests they
+skip in `redirect_hops_saved_total`.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+from django import db
+
+from readability import metrics
+from readability import models
+from readability import settings
+from readability import util
+
+
+class RedirectCache(object):
+  """Redirects stored in the database, for `util.Fetch()`."""
+
+  def Lookup(self, url):
+    """Return (final URL, hops skipped), or None if unknown."""
+    if not settings.REDIRECT_CACHE_SECONDS:
+      return None
+    try:
+      redirect = models.Redirect.objects.filter(
+          url=url, expire_time__gt=time.time()).first()
+    except db.Error:
+      util.log.exception('Could not look up redirect of %s', url)
+      return None
+    if redirect is None:
+      metrics.Inc('cache_total', ('redirect', 'miss'))
+      return None
+    metrics.Inc('cache_total', ('redirect', 'hit'))
+    metrics.Inc('redirect_hops_saved_total', value=redirect.hops)
+    return redirect.final_url, redirect.hops
+
+  def Record(self, url, final_url, hops):
+    """Remember that `url` redirected, in `hops` steps, to `final_url`."""
+    if not settings.REDIRECT_CACHE_SECONDS:
+      return
+    try:
+      models.Redirect.objects.update_or_create(
+          url=url, defaults={
+              'final_url': final_url,
+              'hops': hops,
+              'expire_time': time.time() + settings.REDIRECT_CACHE_SECONDS,
+              })
+    except db.Error:
+      util.log.exception('Could not store redirect of %s', url)
+
+
+def DeleteExpired():
+  models.Redirect.objects.filter(expire_time__lte=time.time()).delete()
@@ -0,0 +1,299 @@
+"""A local stand-in for the web, to test fetching and feeds without a network.
+
+Serves recorded responses with their original status and headers, and
+synthetic feeds whose entries link to pages from the corpus.  Any URL can
+take these query parameters, which are removed before looking up what to
+serve, to exercise the fetching code:
+
+  latency=SEC    Wait before responding.
+  redirects=N    Redirect (302) N times before serving.  Each hop sets a
+                 cookie, and later hops answer 400 unless every earlier cookie
+                 is sent.
+  permanent=1    With redirects, redirect with 301s, which set no cookies.
+  status=CODE    Respond with this (error) status.
+  trickle=SEC    Send the body in pieces, spread over this long.
+
+Usage:
+  origin = replay_origin.ReplayOrigin(latency=0.2)
+  origin.AddFeeds(10, entries=20)
+  origin.Start()
+  ... fetch origin.Url('/feeds/0.xml') ...
+  origin.Stop()
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+import datetime
+import html
+import http.cookies
+import http.server
+import json
+import pathlib
+import random
+import threading
+import time
+import urllib.parse
+
+from readability import corpus
+
+# On disk, one directory per recording: `meta.json` with 'url', 'status' and
+# 'headers' (a list of [name, value]), and the raw `body`.
+Recording = collections.namedtuple(
+    'Recording', ('status', 'headers', 'body'))
+
+_CONTROL_PARAMS = (
+    'latency', 'redirects', 'hops', 'permanent', 'status', 'trickle')
+_TRICKLE_PIECES = 10
+
+
+def LoadRecording(directory):
+  """Return (URL, `Recording`) from a recording directory."""
+  directory = pathlib.Path(directory)
+  with open(directory / 'meta.json') as f:
+    meta = json.load(f)
+  with open(directory / 'body', 'rb') as f:
+    body = f.read()
+  headers = [tuple(header) for header in meta['headers']]
+  return meta['url'], Recording(meta['status'], headers, body)
+
+
+def SaveRecording(directory, url, recording, **extra_meta):
+  """Save a `Recording` of `url`, plus any other metadata, to a directory."""
+  directory = pathlib.Path(directory)
+  directory.mkdir(parents=True, exist_ok=True)
+  meta = dict(extra_meta)
+  meta.update({
+      'url': url,
+      'status': recording.status,
+      'headers': [list(header) for header in recording.headers],
+      })
+  with open(directory / 'body', 'wb') as f:
+    f.write(recording.body)
+  with open(directory / 'meta.json', 'w') as f:
+    json.dump(meta, f, indent=2)
+
+
+class ReplayOrigin(object):
+  """Serve recordings and synthetic feeds from a local HTTP server."""
+
+  def __init__(self, latency=0.0, error_rate=0.0, trickle=0.0, seed=0):
+    """Defaults for every response; parameters in a URL override them.
+
+    Args:
+      latency: Seconds to wait before each response.
+      error_rate: Fraction of responses which are 500 errors.
+      trickle: Seconds over which to send each body.
+      seed: For choosing which responses are errors.
+    """
+    self.latency = latency
+    self.error_rate = error_rate
+    self.trickle = trickle
+    self._random = random.Random(seed)
+    self._routes = {}
+    self._feeds = []
+    self._lock = threading.Lock()
+    self._server = None
+    self.requests = 0
+
+  def Add(self, path, recording):
+    """Serve a `Recording` at a path (and query), on any host."""
+    self._routes[path] = recording
+
+  def AddRecordingDir(self, directory):
+    """Serve every recording in a directory of recording directories."""
+    for recording_dir in sorted(pathlib.Path(directory).iterdir()):
+      if (recording_dir / 'meta.json').exists():
+        url, recording = LoadRecording(recording_dir)
+        self.Add(_PathAndQuery(url), recording)
+
+  def AddFeeds(self, count, entries=10, link_query=''):
+    """Serve synthetic feeds at /feeds/<n>.xml, for n in range(count).
+
+    Each entry links to a page at /pages/<feed>/<entry>.html, whose body is
+    one of the corpus pages.  `link_query` is appended to each entry's link,
+    e.g. 'redirects=3' to make every page fetch follow redirects.
+    """
+    pages = _HtmlPages()
+    for unused_i in range(count):
+      feed_number = len(self._feeds)
+      self._feeds.append({'entries': 0, 'link_query': link_query})
+      self._AddEntries(feed_number, entries, pages)
+
+  def AdvanceFeeds(self, entries=1):
+    """Add new entries to each synthetic feed, as if published since."""
+    pages = _HtmlPages()
+    for feed_number in range(len(self._feeds)):
+      self._AddEntries(feed_number, entries, pages)
+
+  def _AddEntries(self, feed_number, count, pages):
+    feed = self._feeds[feed_number]
+    for unused_i in range(count):
+      page = pages[(feed_number + feed['entries']) % len(pages)]
+      self.Add(
+          '/pages/%d/%d.html' % (feed_number, feed['entries']),
+          Recording(200, [('Content-Type', 'text/html; charset=utf-8')],
+                    page.html.encode('utf-8')))
+      feed['entries'] += 1
+
+  def FeedUrls(self):
+    return [self.Url('/feeds/%d.xml' % n) for n in range(len(self._feeds))]
+
+  def _FeedXml(self, feed_number):
+    feed = self._feeds[feed_number]
+    entries = []
+    now = time.time()
+    # Newest first, an hour apart.
+    for n in reversed(range(feed['entries'])):
+      link = self.Url('/pages/%d/%d.html' % (feed_number, n))
+      if feed['link_query']:
+        link += '?' + feed['link_query']
+      published = datetime.datetime.fromtimestamp(
+          now - (feed['entries'] - n) * 3600, datetime.timezone.utc)
+      entries.append(
+          '<entry><id>%(link)s</id><title>Entry %(n)d</title>'
+          '<link href="%(link)s"/><published>%(date)s</published>'
+          '<updated>%(date)s</updated>'
+          '<summary>Summary of entry %(n)d.</summary></entry>' % {
+              'link': html.escape(link), 'n': n,
+              'date': published.isoformat()})
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<feed xmlns="http://www.w3.org/2005/Atom">'
+        '<title>Replay feed %d</title><link href="%s"/>'
+        '<id>%s</id><updated>%s</updated>%s</feed>' % (
+            feed_number, self.Url('/'), self.Url('/feeds/%d' % feed_number),
+            datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            ''.join(entries))).encode('utf-8')
+
+  def Lookup(self, path):
+    """Return the `Recording` to serve for a path, without control params."""
+    if path.startswith('/feeds/') and path.endswith('.xml'):
+      try:
+        feed_number = int(path[len('/feeds/'):-len('.xml')])
+        xml = self._FeedXml(feed_number)
+      except (ValueError, IndexError):
+        return None
+      return Recording(
+          200, [('Content-Type', 'application/atom+xml; charset=utf-8')], xml)
+    return self._routes.get(path)
+
+  def Start(self, port=0):
+    self._server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', port), _Handler)
+    self._server.daemon_threads = True
+    self._server.origin = self
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+  def Stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+  def Url(self, path):
+    return 'http://127.0.0.1:%d%s' % (self._server.server_address[1], path)
+
+  def IsRandomError(self):
+    if not self.error_rate:
+      return False
+    with self._lock:
+      return self._random.random() < self.error_rate
+
+
+def _HtmlPages():
+  return [page for page in corpus.Pages() if page.html.lstrip().startswith('<')]
+
+
+def _PathAndQuery(url):
+  parts = urllib.parse.urlsplit(url)
+  return parts.path + ('?' + parts.query if parts.query else '')
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    origin = self.server.origin
+    with origin._lock:
+      origin.requests += 1
+    parts = urllib.parse.urlsplit(self.path)
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    control = {k: v for k, v in query if k in _CONTROL_PARAMS}
+    rest = [(k, v) for k, v in query if k not in _CONTROL_PARAMS]
+    path = parts.path + ('?' + urllib.parse.urlencode(rest) if rest else '')
+
+    time.sleep(float(control.get('latency', origin.latency)))
+
+    redirects = int(control.get('redirects', 0))
+    hops = int(control.get('hops', redirects))
+    permanent = control.get('permanent') == '1'
+    cookies = http.cookies.SimpleCookie(self.headers.get('Cookie', ''))
+    missing = [
+        hop for hop in range(redirects + 1, hops + 1)
+        if 'replay_hop_%d' % hop not in cookies]
+    if missing and not permanent:
+      self._Send(Recording(
+          400, [('Content-Type', 'text/plain')],
+          b'Missing cookies from redirect hops %r' % missing))
+      return
+    if redirects:
+      next_control = dict(control, redirects=redirects - 1, hops=hops)
+      location = parts.path + '?' + urllib.parse.urlencode(
+          rest + sorted(next_control.items()))
+      if permanent:
+        self._Send(Recording(301, [('Location', location)], b''))
+      else:
+        self._Send(Recording(302, [
+            ('Location', location),
+            ('Set-Cookie', 'replay_hop_%d=1; Path=/' % redirects),
+            ], b''))
+      return
+
+    if 'status' in control:
+      recording = Recording(
+          int(control['status']), [('Content-Type', 'text/plain')],
+          b'Requested status')
+    elif origin.IsRandomError():
+      recording = Recording(
+          500, [('Content-Type', 'text/plain')], b'Random error')
+    else:
+      recording = origin.Lookup(path) or Recording(
+          404, [('Content-Type', 'text/plain')], b'Not recorded')
+    self._Send(recording, float(control.get('trickle', origin.trickle)))
+
+  def _Send(self, recording, trickle=0.0):
+    self.send_response(recording.status)
+    for name, value in recording.headers:
+      if name.lower() in ('content-length', 'transfer-encoding', 'connection',
+                          'content-encoding'):
+        # The body is stored decoded, and sent whole.
+        continue
+      self.send_header(name, value)
+    self.send_header('Content-Length', str(len(recording.body)))
+    self.end_headers()
+    if not trickle:
+      self.wfile.write(recording.body)
+      return
+    piece = max(1, len(recording.body) // _TRICKLE_PIECES + 1)
+    for start in range(0, len(recording.body), piece):
+      self.wfile.write(recording.body[start:start + piece])
+      self.wfile.flush()
+      time.sleep(trickle / _TRICKLE_PIECES)
+
+  def log_message(self, *unused_args):
+    pass
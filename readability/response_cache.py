@@ -0,0 +1,272 @@
+"""A size-bounded, compressed cache of fetched responses, for `util.Fetch()`.
+
+A `requests_cache` SQLite backend, in response_cache.db, whose responses are
+stored zlib compressed, with their size and when they were last used (to
+within a few minutes).  A running total of their size is kept as they are
+stored and deleted.  Past RESPONSE_CACHE_MAX_BYTES (of compressed responses),
+the least recently used are evicted, down to nine tenths of that.  Expired
+responses are deleted by `DeleteExpired()`, in small batches, each its own
+short transaction; with write-ahead logging, readers are never blocked
+meanwhile.
+
+Evictions count in `response_cache_evictions_total`, and compressed bytes
+stored and served in `response_cache_bytes_total`; `Stats()` gives the size of
+the cache now.  Lookups count in `cache_total{cache="requests"}`.
+
+This subclasses requests_cache's SQLite backend, and relies on how it stores
+responses; requirements.txt pins its exact version.  requests_cache.db, the
+unbounded cache that came before, is deleted when this one is first used.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import functools
+import time
+import zlib
+
+from requests_cache.backends import base
+from requests_cache.backends import sqlite
+from requests_cache.serializers import pickle_serializer
+from requests_cache.serializers.pipeline import SerializerPipeline
+from requests_cache.serializers.pipeline import Stage
+
+from readability import metrics
+from readability import settings
+from readability import util
+
+
+# Rows deleted per transaction, when expiring or evicting.
+_BATCH_SIZE = 100
+# Evict down to this fraction of the byte budget, so as not to evict on every
+# store once full.
+_LOW_WATER = 0.9
+# Seconds a hit may go without updating when its response was last used; so
+# hits on a popular response only write once in a while.
+_ACCESSED_RESOLUTION = 300
+# Columns of the responses table, small ones first: reading any column after
+# a large value means walking the value's overflow pages.
+_COLUMNS = ('key', 'expires', 'size', 'accessed', 'value')
+
+_SERIALIZER = SerializerPipeline(
+    list(pickle_serializer.stages) + [Stage(zlib, 'compress', 'decompress')],
+    name='pickle_zlib', is_binary=True)
+
+
+class BoundedSQLiteDict(sqlite.SQLiteDict):
+  """Stored responses, evicted least recently used first past `max_bytes`.
+
+  Their total size and count are kept in a one-row table, by triggers, so
+  every insert, replace and delete (including those of `SQLiteDict`) updates
+  them in its own transaction.
+  """
+
+  def __init__(self, db_path, max_bytes=0, **kwargs):
+    self.max_bytes = max_bytes
+    super().__init__(db_path, **kwargs)
+
+  def init_db(self):
+    self.close()
+    table = self.table_name
+    with self.connection(commit=True) as con:
+      columns = tuple(
+          row[1] for row in con.execute('PRAGMA table_info(%s)' % table))
+      if columns and columns != _COLUMNS:
+        # Made by an older version; it's only a cache.
+        con.execute('DROP TABLE %s' % table)
+        con.execute('DROP TABLE IF EXISTS %s_totals' % table)
+      con.execute(
+          'CREATE TABLE IF NOT EXISTS %s ('
+          '    key TEXT PRIMARY KEY,'
+          '    expires INTEGER,'
+          '    size INTEGER NOT NULL DEFAULT 0,'
+          '    accessed REAL NOT NULL DEFAULT 0,'
+          '    value BLOB'
+          ')' % table)
+      con.execute(
+          'CREATE INDEX IF NOT EXISTS %s_expires_idx ON %s(expires)'
+          % (table, table))
+      con.execute(
+          'CREATE INDEX IF NOT EXISTS %s_accessed_idx ON %s(accessed)'
+          % (table, table))
+      con.execute(
+          'CREATE TABLE IF NOT EXISTS %s_totals ('
+          '    id INTEGER PRIMARY KEY CHECK (id = 0),'
+          '    bytes INTEGER NOT NULL,'
+          '    entries INTEGER NOT NULL'
+          ')' % table)
+      # Only when the totals are new: counts what is already stored.
+      con.execute(
+          'INSERT OR IGNORE INTO %s_totals (id, bytes, entries) '
+          'SELECT 0, COALESCE(SUM(size), 0), COUNT(*) FROM %s'
+          % (table, table))
+      con.execute(
+          'CREATE TRIGGER IF NOT EXISTS %s_insert AFTER INSERT ON %s BEGIN'
+          '  UPDATE %s_totals SET'
+          '      bytes = bytes + new.size, entries = entries + 1;'
+          ' END' % (table, table, table))
+      con.execute(
+          'CREATE TRIGGER IF NOT EXISTS %s_delete AFTER DELETE ON %s BEGIN'
+          '  UPDATE %s_totals SET'
+          '      bytes = bytes - old.size, entries = entries - 1;'
+          ' END' % (table, table, table))
+      con.execute(
+          'CREATE TRIGGER IF NOT EXISTS %s_update AFTER UPDATE OF size ON %s'
+          ' BEGIN'
+          '  UPDATE %s_totals SET bytes = bytes - old.size + new.size;'
+          ' END' % (table, table, table))
+
+  def __getitem__(self, key):
+    with self.connection() as con:
+      row = con.execute(
+          'SELECT accessed, value FROM %s WHERE key=?' % self.table_name,
+          (key,)).fetchone()
+    if not row:
+      raise KeyError(key)
+    accessed, value = row
+    now = time.time()
+    if now - accessed > _ACCESSED_RESOLUTION:
+      with self.connection(commit=True) as con:
+        con.execute(
+            'UPDATE %s SET accessed=? WHERE key=?' % self.table_name,
+            (now, key))
+    metrics.Inc('response_cache_bytes_total', ('served',), len(value))
+    return self.deserialize(key, value)
+
+  def __setitem__(self, key, value):
+    expires = getattr(value, 'expires_unix', None)
+    value = self.serialize(value)
+    with self.connection(commit=True) as con:
+      # Not INSERT OR REPLACE, whose delete of the old row the delete trigger
+      # wouldn't see.
+      con.execute(
+          'INSERT INTO %s (key, expires, size, accessed, value) '
+          'VALUES (?, ?, ?, ?, ?) '
+          'ON CONFLICT(key) DO UPDATE SET expires=excluded.expires,'
+          '    size=excluded.size, accessed=excluded.accessed,'
+          '    value=excluded.value' % self.table_name,
+          (key, expires, len(value), time.time(), value))
+    metrics.Inc('response_cache_bytes_total', ('stored',), len(value))
+    if self.max_bytes:
+      self._EvictOverBudget()
+
+  def clear(self):
+    # Not `SQLiteDict.clear()`, which drops the table, and with it the
+    # triggers; deleted in one transaction, the totals stay right.
+    with self.connection(commit=True) as con:
+      con.execute('DELETE FROM %s' % self.table_name)
+    self.vacuum()
+
+  def Totals(self):
+    """Return (bytes, entries) of the responses stored."""
+    with self.connection() as con:
+      return con.execute(
+          'SELECT bytes, entries FROM %s_totals' % self.table_name).fetchone()
+
+  def _EvictOverBudget(self):
+    total = self.Totals()[0]
+    if total <= self.max_bytes:
+      return
+    target = self.max_bytes * _LOW_WATER
+    while total > target:
+      with self.connection(commit=True) as con:
+        rows = con.execute(
+            'SELECT key, size FROM %s ORDER BY accessed LIMIT ?'
+            % self.table_name, (_BATCH_SIZE,)).fetchall()
+        if not rows:
+          break
+        keys = []
+        for key, size in rows:
+          if total <= target:
+            break
+          keys.append((key,))
+          total -= size
+        con.executemany(
+            'DELETE FROM %s WHERE key=?' % self.table_name, keys)
+      metrics.Inc('response_cache_evictions_total', ('size',), len(keys))
+
+  def DeleteExpired(self):
+    """Delete expired responses, a batch per transaction; return how many."""
+    deleted = 0
+    while True:
+      with self.connection(commit=True) as con:
+        count = con.execute(
+            'DELETE FROM %s WHERE key IN ('
+            '    SELECT key FROM %s WHERE expires <= ? LIMIT ?)'
+            % (self.table_name, self.table_name),
+            (round(time.time()), _BATCH_SIZE)).rowcount
+      deleted += count
+      if count < _BATCH_SIZE:
+        break
+    metrics.Inc('response_cache_evictions_total', ('expired',), deleted)
+    return deleted
+
+
+class BoundedSQLiteCache(sqlite.SQLiteCache):
+  """`requests_cache` backend storing responses in a `BoundedSQLiteDict`."""
+
+  def __init__(self, db_path, max_bytes=0, **kwargs):
+    # Not `SQLiteCache.__init__()`, which would create the responses table
+    # without the columns for eviction.
+    base.BaseCache.__init__(self, cache_name=str(db_path), **kwargs)
+    self.responses = BoundedSQLiteDict(
+        db_path, max_bytes=max_bytes, table_name='responses',
+        serializer=_SERIALIZER, **kwargs)
+    self.redirects = sqlite.SQLiteDict(
+        db_path, table_name='redirects', serializer=None, **kwargs)
+
+  def DeleteExpired(self):
+    """Delete expired responses, and redirects to any no longer stored."""
+    self.responses.DeleteExpired()
+    with self.redirects.connection(commit=True) as con:
+      con.execute(
+          'DELETE FROM %s WHERE value NOT IN (SELECT key FROM %s)'
+          % (self.redirects.table_name, self.responses.table_name))
+
+
+@functools.lru_cache(maxsize=None)
+def Backend():
+  """The backend for `util.RequestsCacheSession()`; one per process."""
+  _DeleteOldCache()
+  return BoundedSQLiteCache(
+      settings.DB_DIR / 'response_cache.db',
+      max_bytes=settings.RESPONSE_CACHE_MAX_BYTES, wal=True)
+
+
+def _DeleteOldCache():
+  """Delete the unbounded cache that `Backend()` replaced, if it's still there."""
+  for suffix in ('', '-wal', '-shm', '-journal'):
+    path = settings.DB_DIR / ('requests_cache.db' + suffix)
+    try:
+      path.unlink()
+    except FileNotFoundError:
+      continue
+    util.log.info('Deleted the old response cache file %s', path)
+
+
+def DeleteExpired():
+  Backend().DeleteExpired()
+
+
+def Stats():
+  """Gauges of what the cache holds now."""
+  total_bytes, entries = Backend().responses.Totals()
+  return {
+      'response_cache_bytes': total_bytes,
+      'response_cache_entries': entries,
+      }
@@ -39,9 +39,62 @@ DATABASES = {
   }
 }
 
+# BeautifulSoup tree builder: 'html.parser', or 'lxml' or 'html5lib' if
+# installed (see requirements-dev.txt).  See `util.Soup()`.
+HTML_PARSER = os.getenv('HTML_PARSER', default='html.parser')
+
+# Score pages in flat arrays: 'array', 'numpy' (if installed), or '' for off.
+# See `readability.score_index`.
+SCORE_ENGINE = os.getenv('SCORE_ENGINE', default='')
+
+# Distinct (class, id) pairs to keep the scoring patterns' words for, across
+# pages.  See `patterns.Process()`.
+CLASSID_CACHE_SIZE = int(os.getenv('CLASSID_CACHE_SIZE', default=20000))
+
+# Bounds on the work of cleaning one page: characters of markup, tags once
+# parsed, and seconds of extraction and munging; 0 for none.  Pages over them
+# are cleaned in a cheaper mode.  See `readability.budget`.
+EXTRACT_MAX_CHARS = int(os.getenv('EXTRACT_MAX_CHARS', default=5000000))
+EXTRACT_MAX_NODES = int(os.getenv('EXTRACT_MAX_NODES', default=50000))
+EXTRACT_MAX_SECONDS = float(os.getenv('EXTRACT_MAX_SECONDS', default=20))
+
+# Threads for `clean.CleanAsync()`: for network-bound stages, and extraction.
+FETCH_THREADS = int(os.getenv('FETCH_THREADS', default=200))
+EXTRACT_THREADS = int(os.getenv('EXTRACT_THREADS', default=os.cpu_count()))
+
+# Read at most this much of a page's body; 0 for no limit.  Bodies that aren't
+# markup or text aren't read at all.  Neither, nor those cut short, are
+# cached.  See `util.Fetch()`.
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', default=10*1024*1024))
+
+# Keep fetched responses this long, in at most this many (compressed) bytes.
+# See `readability.response_cache`.
+RESPONSE_CACHE_SECONDS = int(
+    os.getenv('RESPONSE_CACHE_SECONDS', default=2*24*60*60))
+RESPONSE_CACHE_MAX_BYTES = int(
+    os.getenv('RESPONSE_CACHE_MAX_BYTES', default=512*1024*1024))
+
+# Start fetches of a URL from where it last redirected to, for this long after
+# that; 0 to always follow redirects.  See `readability.redirects`.
+REDIRECT_CACHE_SECONDS = int(
+    os.getenv('REDIRECT_CACHE_SECONDS', default=7*24*60*60))
+
+# `/page?profile=<token>` returns a profile of the clean; unset disables it
+# (except with DEBUG).  Profiles are also saved in PROFILE_DIR, if set.
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', default='')
+PROFILE_DIR = os.getenv('PROFILE_DIR', default='')
+
+# Save the fetched inputs of failed cleans, and those slower than this, in
+# CAPTURE_DIR (unset disables), keeping the newest CAPTURE_MAX_COUNT.
+CAPTURE_DIR = os.getenv('CAPTURE_DIR', default='')
+CAPTURE_SLOW_SECONDS = float(os.getenv('CAPTURE_SLOW_SECONDS', default=5))
+CAPTURE_MAX_COUNT = int(os.getenv('CAPTURE_MAX_COUNT', default=100))
+
 HUEY = {
-  # Queue tasks only in memory, they're always based on DB state.
-  'huey_class': 'huey.MemoryHuey',
+  # Persist queued and scheduled tasks across restarts, and drop duplicates of
+  # tasks that are still outstanding.  See `readability.task_queue`.
+  'huey_class': 'readability.task_queue.UniqueSqliteHuey',
+  'filename': str(DB_DIR / 'huey.db'),
   'consumer': {
     'workers': 4,
     'worker_type': 'thread',
@@ -62,3 +115,4 @@ TEMPLATES = [{
 }]
 USE_TZ = False
 WSGI_APPLICATION = 'wsgi.application'
+ASGI_APPLICATION = 'asgi.application'
@@ -0,0 +1,221 @@
+"""Special handling for particular sites, looked up by host name.
+
+Each `Site` lists the host names it applies to, including their subdomains,
+and overrides the hooks for the stages it changes.  `Lookup()` finds the site
+for a URL with one dict lookup per label of its host name ('a.b.com', then
+'b.com', then 'com'), so adding sites doesn't slow down cleaning any other
+URL.  A site's hooks may still check the rest of the URL.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import urllib.parse
+
+import bs4
+
+from readability import util
+
+
+_SITES = {}
+
+
+class Site(object):
+  """Handling for one site; by default, none special."""
+
+  # Host names this applies to, with their subdomains.
+  hosts = ()
+  # False to never extract this site's pages from its feeds.
+  use_feed = True
+  # False to keep the content of this site's entries in subscribed feeds,
+  # rather than fetch and clean their pages.
+  fetch_entries = True
+  # False to keep what precedes a header that repeats the page's title.
+  strip_before_title = True
+
+  def NormalizeUrl(self, url):
+    """Return the URL to clean instead of this one."""
+    return url
+
+  def CleanUrl(self, url):
+    """Return HTML for a URL that needs no fetch, or None."""
+    return None
+
+  def Extract(self, url, html):
+    """Return (soup, tag) extracted from a page, or None for the default."""
+    return None
+
+  def Strainer(self, url):
+    """Return a `bs4.SoupStrainer` to parse only part of a page, or None."""
+    return None
+
+  def PostScore(self, url, soup):
+    """Adjust a page after it is scored, before its best node is picked."""
+
+  def Munge(self, url, tag):
+    """Adjust the picked content before it is munged."""
+
+
+def Register(site_class):
+  """Class decorator: handle the site's hosts with an instance of it."""
+  site = site_class()
+  for host in site.hosts:
+    _SITES[host] = site
+  return site_class
+
+
+_DEFAULT = Site()
+
+
+def Lookup(url):
+  """Return the `Site` for a URL: by its host name, or a parent domain's."""
+  host = (urllib.parse.urlparse(url).hostname or '').rstrip('.')
+  while host:
+    site = _SITES.get(host)
+    if site is not None:
+      return site
+    host = host.partition('.')[2]
+  return _DEFAULT
+
+
+@Register
+class Cracked(Site):
+  hosts = ('www.cracked.com',)
+
+  def PostScore(self, url, soup):
+    tag = soup.find(attrs={'class': 'Column2'})
+    if tag: util.Strip(tag)
+    tag = soup.find(attrs={'class': 'userStyled'})
+    if tag: util.ApplyScore(tag, 20, name='special')
+
+
+@Register
+class Flickr(Site):
+  hosts = ('flickr.com',)
+  strip_before_title = False
+
+
+@Register
+class Gfycat(Site):
+  hosts = ('gfycat.com',)
+
+  def Extract(self, url, html):
+    if not re.search(r'^https://gfycat.com/[a-zA-Z]+$', url, re.I):
+      return None
+    soup = util.Soup(html)
+    vid = soup.find('video')
+    del vid['autoplay']
+    vid['controls'] = 'controls'
+    return soup, vid
+
+
+@Register
+class GoogleDocs(Site):
+  hosts = ('docs.google.com', 'spreadsheets.google.com')
+  use_feed = False
+
+  def NormalizeUrl(self, url):
+    match = re.search(
+        r'^https?://docs.google.com.*cache:.*?:(.*?\.pdf)', url, re.I)
+    if match:
+      url = match.group(1)
+      if 'http' not in url:
+        url = 'http://' + url
+    return url
+
+  def CleanUrl(self, url):
+    match = re.search(
+        r'^https?://docs.google.com.*docid=(.*?)(&|$)', url, re.I)
+    if match:
+      return util.RenderTemplate(
+          'google-docs.html', {'docid': match.group(1), 'url': url})
+    return None
+
+
+@Register
+class GoogleGroups(Site):
+  hosts = ('groups.google.com',)
+
+  def Strainer(self, url):
+    if re.search(r'^http://groups\.google\.com/', url, re.I):
+      return bs4.SoupStrainer(attrs={'class': 'maincontbox'})
+    return None
+
+
+@Register
+class Reddit(Site):
+  hosts = ('reddit.com', 'redd.it')
+  # Don't hammer reddit's servers; use original feed content instead.
+  # (Otherwise our IP gets banned and we can't fetch anyway.)
+  use_feed = False
+  fetch_entries = False
+
+  def NormalizeUrl(self, url):
+    return url.replace('www.reddit.com', 'old.reddit.com')
+
+  def Extract(self, url, html):
+    if not re.search(r'^http://(www\.)?reddit\.com/.*/comments/', url, re.I):
+      return None
+    strainer = bs4.SoupStrainer(
+        attrs={'class': re.compile(r'thing.*link|usertext border')})
+    soup = util.Soup(html, parse_only=strainer)
+    body = soup.find(attrs={'class': re.compile(r'\busertext-body\b')})
+    if not body:
+      body = soup.find('a', attrs={'class': re.compile(r'\btitle\b')})
+      body = body and body.text or soup
+    return soup, body
+
+  def PostScore(self, url, soup):
+    tag = soup.find(attrs={'class': 'side'})
+    if tag: util.Strip(tag, 'reddit side')
+
+
+@Register
+class SmashingMagazine(Site):
+  hosts = ('smashingmagazine.com',)
+
+  def Munge(self, url, tag):
+    for table in tag.findAll('table', width='650'):
+      util.Strip(table)
+
+
+@Register
+class Xkcd(Site):
+  hosts = ('xkcd.com',)
+
+  def Extract(self, url, html):
+    if not re.search(r'^http://(www\.)?xkcd\.com/\d+', url, re.I):
+      return None
+    soup = util.Soup(html)
+    img = soup.find(alt=True, title=True)
+    cont = img.parent.parent
+    for tag in cont.findAll(('br', 'div')):
+      util.Strip(tag)
+    return soup, cont
+
+
+@Register
+class YouTube(Site):
+  hosts = ('www.youtube.com',)
+
+  def CleanUrl(self, url):
+    if re.search(r'^https?://www\.youtube\.com/watch', url, re.I):
+      video_id = re.search(r'v=([^&]+)', url).group(1)
+      return util.RenderTemplate('youtube.html', {'video_id': video_id})
+    return None
@@ -0,0 +1,179 @@
+"""Durable, de-duplicating Huey task queue.
+
+Tasks live in a local SQLite file, so a restart keeps everything queued and
+scheduled.  Task types decorated with `Unique` carry a key (e.g. the feed URL);
+enqueueing a task while another with the same key is still queued, scheduled
+or running is a no-op.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import os
+import socket
+import time
+
+import huey
+
+from readability import metrics
+from readability import util
+
+
+# A unique key older than this (past its task's ETA) is assumed to belong to a
+# task lost in a crash, and no longer blocks new tasks.
+UNIQUE_KEY_TTL = datetime.timedelta(hours=6).total_seconds()
+
+# Published metrics older than this are from a process that has gone away.
+METRICS_MAX_AGE = datetime.timedelta(hours=1).total_seconds()
+
+_UNIQUE_PREFIX = 'unique:'
+_METRICS_PREFIX = 'metrics:'
+_METRICS_KEY = '%s%s:%d' % (_METRICS_PREFIX, socket.gethostname(), os.getpid())
+_metrics_published_time = 0
+_UNIQUE_KEY_FUNCS = {}
+
+
+def Unique(key_func):
+  """Decorate a task so that only one with a given key is queued at a time.
+
+  Apply outside of `db_task()`.  `key_func` is called with the task's
+  arguments and returns a string key.
+  """
+  def decorator(task_wrapper):
+    _UNIQUE_KEY_FUNCS[task_wrapper.task_class] = key_func
+    return task_wrapper
+  return decorator
+
+
+def _UniqueKey(task):
+  key_func = _UNIQUE_KEY_FUNCS.get(type(task))
+  if not key_func:
+    return None
+  key = key_func(*task.args, **task.kwargs)
+  return '%s%s:%s' % (_UNIQUE_PREFIX, task.name, key)
+
+
+class UniqueSqliteHuey(huey.SqliteHuey):
+  """SqliteHuey which drops duplicates of tasks that are still outstanding."""
+
+  def enqueue(self, task):
+    key = _UniqueKey(task)
+    if key and not self._ClaimUniqueKey(key, task):
+      util.log.info('Dropping duplicate task %s (%s).', task.name, key)
+      return None
+    return super(UniqueSqliteHuey, self).enqueue(task)
+
+  def _execute(self, task, timestamp):
+    try:
+      return super(UniqueSqliteHuey, self)._execute(task, timestamp)
+    finally:
+      key = _UniqueKey(task)
+      if key:
+        held = self.get(key, peek=True)
+        if held and held[0] == task.id:
+          self.delete(key)
+
+  def _ClaimUniqueKey(self, key, task):
+    record = (task.id, self._ReadyTime(task))
+    if self.put_if_empty(key, record):
+      return True
+    held = self.get(key, peek=True)
+    if not held:
+      # Released between our two reads.
+      return self.put_if_empty(key, record)
+    if held[0] == task.id:
+      # The same task coming back around, e.g. from the schedule.
+      return True
+    if held[1] + UNIQUE_KEY_TTL < time.time():
+      util.log.warning('Replacing stale unique key %s.', key)
+      self.put(key, record)
+      return True
+    return False
+
+  def _ReadyTime(self, task):
+    if not task.eta:
+      return time.time()
+    if self.utc:
+      return task.eta.replace(tzinfo=datetime.timezone.utc).timestamp()
+    return task.eta.timestamp()
+
+
+def ReadPrefixed(queue, prefix):
+  """Return a dict of all stored data whose key starts with `prefix`.
+
+  Returns None if the queue's storage can't be searched by key.
+  """
+  storage = queue.storage
+  if not hasattr(storage, 'sql'):
+    return None
+  rows = storage.sql(
+      'select key, value from kv where queue = ? and key like ?',
+      (storage.name, prefix + '%'), results=True)
+  return {
+      key: queue.serializer.deserialize(bytes(value)) for key, value in rows}
+
+
+def Stats(queue):
+  """Return a dict describing queue depth and lag, for sizing workers.
+
+  Lag is how far past its due time the oldest outstanding unique task is;
+  it includes tasks currently running.
+  """
+  stats = {
+      'pending': queue.pending_count(),
+      'scheduled': queue.scheduled_count(),
+      'outstanding': None,
+      'lag_seconds': None,
+      }
+  records = ReadPrefixed(queue, _UNIQUE_PREFIX)
+  if records is None:
+    return stats
+
+  ready_times = [ready for unused_id, ready in records.values()]
+  stats['outstanding'] = len(ready_times)
+  stats['lag_seconds'] = max(
+      [0.0] + [time.time() - ready for ready in ready_times])
+  return stats
+
+
+def PublishMetrics(queue, min_interval=0):
+  """Store this process's metrics where any process can `GatherMetrics()`.
+
+  Does nothing if this process published less than `min_interval` seconds ago.
+  """
+  global _metrics_published_time
+  now = time.time()
+  if now < _metrics_published_time + min_interval:
+    return
+  _metrics_published_time = now
+  queue.put(_METRICS_KEY, (now, metrics.Snapshot()))
+
+
+def GatherMetrics(queue):
+  """Return metrics merged across every process which recently published."""
+  snapshots = [metrics.Snapshot()]
+  published = ReadPrefixed(queue, _METRICS_PREFIX) or {}
+  for key, (published_time, snapshot) in published.items():
+    if key == _METRICS_KEY:
+      continue
+    if published_time + METRICS_MAX_AGE < time.time():
+      queue.delete(key)
+      continue
+    snapshots.append(snapshot)
+  return metrics.Merge(snapshots)
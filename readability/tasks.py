@@ -25,10 +25,14 @@ import time
 
 from django.db.models import F
 from huey import crontab
+from huey.contrib.djhuey import HUEY
 from huey.contrib.djhuey import db_periodic_task
 
 from readability import feed
 from readability import models
+from readability import redirects
+from readability import response_cache
+from readability import task_queue
 from readability import util
 
 def period(period):
@@ -52,32 +56,33 @@ def period(period):
   return validator
 
 
-@db_periodic_task(period(datetime.timedelta(
-    minutes=1 if util.DEBUG else 10)))
+_SCHEDULE_PERIOD = datetime.timedelta(minutes=1 if util.DEBUG else 10)
+# Start at most one overdue feed update per this many seconds.
+_CATCHUP_INTERVAL_SEC = 3
+
+
+@db_periodic_task(period(_SCHEDULE_PERIOD))
 def ScheduleFeedUpdates():
   """Periodically check for stale feeds, schedule tasks to update them."""
-  # Don't schedule for this many seconds, to avoid double-scheduling. E.g.
-  # we run every N minutes, the next check is in N minutes plus one MS.
-  # We schedule a check now, and then in N minutes we check and the next
-  # fetch is still in the future -- that scheduled check hasn't completed
-  # -- so we schedule a second!  Pick a duration that should be longer
-  # than any `feed.UpdateFeed()` execution, so it's always updated the
-  # feed before we check again.
-  jitter_sec = 15
+  # Schedule every feed due before our next run.  A feed whose update is still
+  # queued or running from an earlier pass is dropped by the queue's unique
+  # key, so there's no double-scheduling to avoid here.  Feeds that are
+  # already overdue (e.g. the first run after a restart, or a backlog) are
+  # spread out, rather than all started in one burst.
+  util.log.info('Task queue: %r', task_queue.Stats(HUEY))
 
   now = time.time()
+  catchup_delay = 0
   for feed_e in models.Feed.objects.order_by(
       F('last_fetch_time') + F('fetch_interval_seconds')):
     update_time = feed_e.last_fetch_time + feed_e.fetch_interval_seconds
-    delay = max(0, update_time - now)
-    update_freq_limit = ((1 if util.DEBUG else 10) * 60 - jitter_sec)
-    if delay > update_freq_limit:  # as period above
-      # 2022-03-07 Very noisy to logs!
-      #util.log.info(
-      #    'Skip feed update for %r: (%.3f seconds, %.3f minutes) '
-      #    '> limit (%.3f seconds)',
-      #    feed_e.url, delay, delay/60, update_freq_limit)
-      continue
+    delay = update_time - now
+    if delay > _SCHEDULE_PERIOD.total_seconds():
+      # Sorted by update time, so every other feed is later still.
+      break
+    if delay <= 0:
+      delay = catchup_delay
+      catchup_delay += _CATCHUP_INTERVAL_SEC
 
     util.log.info(
         'Scheduling update (in %.3f seconds) of %s ...', delay, feed_e.url)
@@ -90,4 +95,11 @@ def StaleEntryCleanup():
   for feed_e in models.Feed.objects.all():
     stale_keys = feed_e.stale_entries.values_list('pk', flat=True)
     models.Entry.objects.filter(pk__in=stale_keys).delete()
-  util.RequestsCacheSession().remove_expired_responses()
+  response_cache.DeleteExpired()
+  redirects.DeleteExpired()
+
+
+@db_periodic_task(period(datetime.timedelta(minutes=1)))
+def PublishMetrics():
+  """Share this worker's metrics with the stats page."""
+  task_queue.PublishMetrics(HUEY)
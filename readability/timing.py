@@ -0,0 +1,124 @@
+"""Cheap per-stage timers for the cleaning pipeline.
+
+Usage:
+  with timing.Collect() as timings:
+    with timing.Stage('fetch'):
+      ...
+    timing.Note('path', 'feed')
+  timings.AsDict()
+
+Stages and notes outside of any `Collect()` cost one context variable lookup,
+so instrumentation can stay in place everywhere.  Timings follow the context
+into executors via `RunInExecutor()`.
+
+--------------------------------------------------------------------------------
+
+Readability API - Clean up pages and feeds to be readable.
+Copyright (C) 2010  Anthony Lieuallen
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import time
+
+
+_CURRENT = contextvars.ContextVar('timings', default=None)
+
+
+class Timings(object):
+  """Total seconds and count per named stage, plus free-form notes."""
+
+  def __init__(self):
+    self.stages = {}
+    self.notes = {}
+
+  def Add(self, name, seconds):
+    try:
+      stage = self.stages[name]
+    except KeyError:
+      stage = self.stages[name] = [0, 0.0]
+    stage[0] += 1
+    stage[1] += seconds
+
+  def AsDict(self):
+    """Flat dict: `<stage>_ms` and `<stage>_count` for each stage, and notes."""
+    result = {}
+    for name, (count, seconds) in self.stages.items():
+      result[name + '_ms'] = round(seconds * 1000, 3)
+      if count > 1:
+        result[name + '_count'] = count
+    result.update(self.notes)
+    return result
+
+  def ServerTiming(self):
+    """Format stages as a Server-Timing HTTP header value."""
+    return ', '.join(
+        '%s;dur=%.1f' % (name, seconds * 1000)
+        for name, (unused_count, seconds) in self.stages.items())
+
+  def __str__(self):
+    return ' '.join('%s=%s' % item for item in self.AsDict().items())
+
+
+@contextlib.contextmanager
+def Collect():
+  """Collect stages run within; joins an enclosing collection if any."""
+  timings = _CURRENT.get()
+  if timings is not None:
+    yield timings
+    return
+  timings = Timings()
+  token = _CURRENT.set(timings)
+  try:
+    yield timings
+  finally:
+    _CURRENT.reset(token)
+
+
+def Current():
+  """The `Timings` being collected, or None."""
+  return _CURRENT.get()
+
+
+def Note(key, value):
+  timings = _CURRENT.get()
+  if timings is not None:
+    timings.notes[key] = value
+
+
+def RunInExecutor(executor, func, *args):
+  """As `loop.run_in_executor()`, keeping the current timings collection."""
+  return asyncio.get_running_loop().run_in_executor(
+      executor, contextvars.copy_context().run, func, *args)
+
+
+class Stage(object):
+  """Context manager: add the time spent within to the named stage."""
+  __slots__ = ('_name', '_start', '_timings')
+
+  def __init__(self, name):
+    self._name = name
+
+  def __enter__(self):
+    self._timings = _CURRENT.get()
+    if self._timings is not None:
+      self._start = time.perf_counter()
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    if self._timings is not None:
+      self._timings.Add(self._name, time.perf_counter() - self._start)
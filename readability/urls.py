@@ -26,5 +26,7 @@ from readability import main
 urlpatterns = [
     path(r'', main.Main),
     path(r'page', main.CleanPage),
+    path(r'batch', main.CleanBatch),
     path(r'feed', main.CleanFeed),
+    path(r'stats', main.Stats),
     ]
@@ -19,6 +19,8 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import contextlib
+import contextvars
 import datetime
 import http.cookies
 import io
@@ -26,6 +28,7 @@ import functools
 import logging
 import os
 import re
+import time
 import urllib.parse
 
 import bs4
@@ -35,19 +38,35 @@ import requests
 import requests.exceptions
 import requests_cache
 
+from readability import metrics
+from readability import response_cache
+from readability import score_index
 from readability import settings
+from readability import timing
 
 
 DEBUG = settings.DEBUG
 RE_CNN_HACK = re.compile(r'<!-- with(out)? htc -->')
 RE_DOCTYPE = re.compile(r'<!DOCTYPE.*?>', re.S)
+# Comments, and script and style elements, in raw markup.  One pattern, so a
+# match is found where the parser would find it: "<!--" inside a script is
+# script, "<script>" inside a comment is comment.
+RE_PAYLOAD = re.compile(
+    r'<!--.*?-->|<(script|style)(?=[\s/>]).*?</\1\s*>', re.I | re.S)
 TAG_NAMES_BLOCK = set(('blockquote', 'div', 'li', 'p', 'pre', 'td', 'th'))
 TAG_NAMES_HEADER = set(('h1', 'h2', 'h3', 'h4', 'h5', 'h6'))
 
-BR_TO_P_STOP_TAGS = set(list(TAG_NAMES_BLOCK) + list(TAG_NAMES_HEADER) + ['br'])
 
 MAX_SCORE_DEPTH = 5
+# Content types (without parameters) of bodies with markup or text to clean.
+TEXT_CONTENT_TYPES = ('text/', 'application/xhtml+xml', 'application/xml')
+_READ_CHUNK_BYTES = 64 * 1024
+# Empty HTML5 elements that libxml2 (via lxml) doesn't know are empty: it nests
+# what follows one, up to its parent's end, inside it.
+RE_LXML_NESTING_TAGS = re.compile(r'<(embed|keygen|source|track|wbr)\b', re.I)
+RE_TBODY = re.compile(r'<tbody\b', re.I)
 _DEPTH_SCORE_DECAY = [(1 - d / 12.0) ** 5 for d in range(MAX_SCORE_DEPTH + 1)]
+_SCORE_INDEX = contextvars.ContextVar('score_index', default=None)
 
 ################################################################################
 
@@ -58,31 +77,52 @@ log.addHandler(_lh)
 
 ################################### HELPERS ####################################
 
-def ApplyScore(tag, score, depth=0, name=None):
-  """Recursively apply a decaying score to each parent up the tree."""
-  if not tag:
-    return
-  if depth > MAX_SCORE_DEPTH:
-    return
-  if tag.name == 'li' and score > 0:
-    # Don't score list items positively.  Too likely to be false positives.
-    return
-  decayed_score = score * _DEPTH_SCORE_DECAY[depth]
+@contextlib.contextmanager
+def ScoreIndexed(root):
+  """Within, buffer scores of tags under `root` in a `ScoreIndex`.
 
-  if not tag.has_attr('score') or not type(tag['score']) is float:
-    tag['score'] = 0.0
-  tag['score'] += decayed_score
+  Yields the index, or None if the SCORE_ENGINE setting is off.  Always off
+  with DEBUG, which records each score's name on the tags.
+  """
+  if not settings.SCORE_ENGINE or DEBUG:
+    yield None
+    return
+  index = score_index.ScoreIndex(
+      root, _DEPTH_SCORE_DECAY, settings.SCORE_ENGINE)
+  token = _SCORE_INDEX.set(index)
+  try:
+    yield index
+  finally:
+    _SCORE_INDEX.reset(token)
 
-  if DEBUG and name:
-    name_key = 'score_%s' % name
-    if not tag.has_attr(name_key):
-      tag[name_key] = 0
-    tag[name_key] = float(tag[name_key]) + decayed_score
-    if not tag.has_attr('all_scores'):
-      tag['all_scores'] = ''
-    tag['all_scores'] += '%s=%s ' % (name_key, decayed_score)
 
-  ApplyScore(tag.parent, score, depth + 1, name=name)
+def ApplyScore(tag, score, depth=0, name=None):
+  """Apply a decaying score to a tag, and each parent up the tree."""
+  if tag and depth == 0:
+    index = _SCORE_INDEX.get()
+    if index is not None and index.Add(tag, score):
+      return
+  while tag and depth <= MAX_SCORE_DEPTH:
+    if tag.name == 'li' and score > 0:
+      # Don't score list items positively.  Too likely to be false positives.
+      return
+    decayed_score = score * _DEPTH_SCORE_DECAY[depth]
+
+    if not tag.has_attr('score') or not type(tag['score']) is float:
+      tag['score'] = 0.0
+    tag['score'] += decayed_score
+
+    if DEBUG and name:
+      name_key = 'score_%s' % name
+      if not tag.has_attr(name_key):
+        tag[name_key] = 0
+      tag[name_key] = float(tag[name_key]) + decayed_score
+      if not tag.has_attr('all_scores'):
+        tag['all_scores'] = ''
+      tag['all_scores'] += '%s=%s ' % (name_key, decayed_score)
+
+    tag = tag.parent
+    depth += 1
 
 
 def CleanUrl(url):
@@ -92,44 +132,176 @@ def CleanUrl(url):
 
 
 def CommentStrip(soup):
-  comments = soup.findAll(text=lambda t: isinstance(t, bs4.Comment))
+  """Remove comments from a soup; return how many tags it has.
+
+  The tags are counted in the same walk, for the node budget, rather than in
+  another `find_all(True)`.
+  """
+  tag_count = 0
+  comments = []
+  for node in soup.descendants:
+    if isinstance(node, bs4.Tag):
+      tag_count += 1
+    elif isinstance(node, bs4.Comment):
+      comments.append(node)
   for comment in comments:
     comment.extract()
+  return tag_count
+
+
+def IsTextContentType(content_type):
+  """Whether a Content-Type header is of markup or text; or is missing."""
+  content_type = (content_type or '').split(';')[0].strip().lower()
+  return (not content_type or content_type.startswith(TEXT_CONTENT_TYPES)
+          or content_type.endswith('+xml'))
+
+
+def Fetch(orig_url, deadline=6, do_cache=True, redirect_cache=None,
+          text_only=False, max_bytes=0):
+  """Fetch a URL, following up to five redirects.
+
+  Raises `requests.exceptions.TooManyRedirects` past those.
+
+  The body is streamed, and read only once the headers are in, per
+  `_ReadBody()`.  Only then is the response cached, if it was read whole.
 
+  Args:
+    orig_url: String, the URL to fetch.
+    deadline: Seconds to wait for each request.
+    do_cache: Whether to use (and fill) the cache of responses.
+    redirect_cache: Optional `redirects.RedirectCache`, to start from where
+        the URL permanently redirected to before, and to remember where it
+        does so now.
+    text_only: If set, don't read bodies that aren't markup or text.
+    max_bytes: If set, read no more of the body than this.
 
-def Fetch(orig_url, deadline=6, do_cache=True):
+  Returns:
+    Tuple of (response, final URL after redirects).
+  """
   cookie = http.cookies.SimpleCookie()
   redirect_limit = 5
   redirects = 0
   url = orig_url
+  source_url = CleanUrl(orig_url)
+  hops_skipped = 0
+  # Whether every redirect followed was permanent (301 or 308).
+  permanent = True
+  session = RequestsCacheSession() if do_cache else None
+  if redirect_cache is not None:
+    cached = redirect_cache.Lookup(source_url)
+    if cached is not None:
+      url, hops_skipped = cached
   while url and redirects < redirect_limit:
     redirects += 1
     url = CleanUrl(url)
     if settings.DEBUG:
       log.info('Fetching %r after %d redirects', url, redirects - 1)
     final_url = url
-    session = requests
-    if do_cache:
-      session = RequestsCacheSession()
-    response = session.get(
-        url,
-        timeout=deadline,
-        headers={
-          'Cookie': cookie.output(attrs=(), header='', sep='; '),
-          'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36',
-        })
+    host = urllib.parse.urlparse(url).hostname or ''
+    # Each cookie is output after a space: ' a=1; b=2'.
+    cookie_header = cookie.output(attrs=(), header='', sep=';').strip()
+    headers = {
+      'Cookie': cookie_header,
+      'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36',
+    }
+    with timing.Stage('fetch_hop'):
+      response = None
+      if session is not None:
+        response = _FromCache(session, url, headers)
+      if response is None:
+        start = time.perf_counter()
+        # Follow redirects here, not in requests: one hop per request, to
+        # carry cookies over and to see where the chain ends.
+        response = requests.get(
+            url,
+            timeout=deadline,
+            stream=True,
+            allow_redirects=False,
+            headers=headers)
+        metrics.Inc('fetch_total', (host,))
+        metrics.Observe(
+            'fetch_seconds', time.perf_counter() - start, (host,))
     try:
       cookie.load(response.headers.get('Set-Cookie', ''))
-    except cookie.CookieError:
+    except http.cookies.CookieError:
       log.exception('Ignoring cookie problem!')
     previous_url = url
     url = response.headers.get('Location')
     if url:
       url = urllib.parse.urljoin(previous_url, url)
+      permanent = permanent and response.status_code in (301, 308)
+      response.close()
+  if url:
+    raise requests.exceptions.TooManyRedirects(
+        'Exceeded %d redirects.' % redirect_limit, response=response)
+  if not getattr(response, 'from_cache', False):
+    with timing.Stage('fetch_body'):
+      complete = _ReadBody(response, host, text_only, max_bytes)
+    if session is not None and complete and _IsCacheable(response):
+      with timing.Stage('fetch_cache_save'):
+        session.cache.save_response(response, expires=(
+            datetime.datetime.utcnow()
+            + datetime.timedelta(seconds=settings.RESPONSE_CACHE_SECONDS)))
+  # Remember a chain that only redirected permanently.  Not its cookies: they
+  # may be per session, and this is shared by every fetch.
+  if redirect_cache is not None and redirects > 1 and permanent:
+    redirect_cache.Record(source_url, final_url, hops_skipped + redirects - 1)
   final_url = urllib.parse.urljoin(orig_url, final_url)
   return (response, final_url)
 
 
+def _FromCache(session, url, headers):
+  """Return the cached response for a URL, or None to request it."""
+  response = session.get(
+      url, headers=headers, allow_redirects=False, only_if_cached=True)
+  # On a miss, a (`CachedResponse`) 504; only 200s are cached.
+  if response.status_code != 504:
+    metrics.Inc('cache_total', ('requests', 'hit'))
+    return response
+  metrics.Inc('cache_total', ('requests', 'miss'))
+  return None
+
+
+def _ReadBody(response, host, text_only, max_bytes):
+  """Read a streamed response's body, as its `content`, and close it.
+
+  A body that isn't text (when `text_only`) is never read; its content is
+  empty.  One longer than `max_bytes` is cut short, as soon as that much has
+  been read.  Bytes received count in `fetch_bytes_total`.
+
+  Returns:
+    Whether the whole body was read.
+  """
+  content_type = response.headers.get('content-type')
+  if text_only and not IsTextContentType(content_type):
+    response.close()
+    response._content = b''
+    timing.Note('body_skipped', content_type)
+    return False
+  chunks = []
+  size = 0
+  complete = True
+  raw = response.raw
+  # Not `iter_content()`: urllib3 reads chunked bodies apart from the count
+  # of bytes received, which `raw.read()` keeps (http.client unchunks them).
+  while not raw.closed:
+    chunk = raw.read(_READ_CHUNK_BYTES, decode_content=True)
+    chunks.append(chunk)
+    size += len(chunk)
+    if max_bytes and size >= max_bytes:
+      timing.Note('body_truncated', max_bytes)
+      complete = False
+      break
+  # As sent, before any content encoding is decoded.
+  wire_bytes = raw.tell()
+  response.close()
+  # Setting the body requests would otherwise read in full, on access.
+  response._content = b''.join(chunks)[:max_bytes or None]
+  timing.Note('bytes_read', wire_bytes)
+  metrics.Inc('fetch_bytes_total', (host,), wire_bytes)
+  return complete
+
+
 def GetFeedEntryContent(entry):
   """Figure out the best content for this entry."""
   # Prefer "content".
@@ -152,12 +324,14 @@ def GetFeedEntryContent(entry):
 def ParseFeedAtUrl(url):
   """Fetch a URL's contents, and parse it as a feed."""
   try:
-    response, _ = Fetch(url, deadline=20, do_cache=False)
+    with timing.Stage('feed_fetch'):
+      response, _ = Fetch(url, deadline=20, do_cache=False)
   except requests.exceptions.ConnectionError as e:
     print('Remote disconnected while fetching %r!' % url)
     return None
   try:
-    feed_feedparser = feedparser.parse(response.content)
+    with timing.Stage('feed_parse'):
+      feed_feedparser = feedparser.parse(response.content)
   except LookupError:
     return None
   else:
@@ -167,9 +341,79 @@ def ParseFeedAtUrl(url):
 def PreCleanHtml(html):
   html = re.sub(RE_DOCTYPE, '', html)
   html = html.replace('&nbsp;', ' ')
+  if _HtmlParser() != 'html.parser':
+    # lxml and html5lib (like browsers) read a stray </br> as <br>, where
+    # html.parser drops it; drop it for them too, to clean alike with each.
+    html = html.replace('</br>', '')
   return html
 
 
+def PrunePayloads(html):
+  """Remove comments, scripts and styles from markup, before parsing.
+
+  They're stripped from the tree anyway, but are often most of a page's
+  bytes; never parsing them is much cheaper.  Unterminated ones are left for
+  the parser.
+  """
+  pruned = RE_PAYLOAD.sub('', html)
+  timing.Note('pruned_bytes', len(html) - len(pruned))
+  return pruned
+
+
+@functools.lru_cache(maxsize=None)
+def _HtmlParser():
+  parser = settings.HTML_PARSER
+  if bs4.builder.builder_registry.lookup(parser) is None:
+    log.warning('HTML_PARSER %r is not installed; using html.parser.', parser)
+    parser = 'html.parser'
+  return parser
+
+
+def Soup(markup='', parse_only=None, fragment=False):
+  """Parse HTML with the tree builder named by the HTML_PARSER setting.
+
+  Builders differ in how they repair broken markup, so output can differ
+  slightly from 'html.parser'; check with `manage.py golden_extract`.  The
+  differences that change which content is picked are undone here: lxml
+  nesting after HTML5 empty elements; the <tbody> html5lib adds to every
+  table, and the whitespace after </body> it moves into the body.
+
+  Args:
+    markup: String of HTML.
+    parse_only: Optional `bs4.SoupStrainer`.  html5lib can't strain while it
+        parses, so these use 'html.parser' instead.
+    fragment: True if markup is a fragment, not a page (e.g. feed content):
+        remove the <html>, <head> and <body> that lxml and html5lib add
+        around it, so the tree has the same shape as with 'html.parser'.
+  """
+  parser = _HtmlParser()
+  if parse_only is not None and parser == 'html5lib':
+    parser = 'html.parser'
+  if parser == 'html5lib':
+    end = markup.rstrip()
+    if end[-7:].lower() == '</html>':
+      end = end[:-7].rstrip()
+    if end[-7:].lower() == '</body>':
+      markup = end
+  soup = bs4.BeautifulSoup(markup, parser, parse_only=parse_only)
+  if parser == 'lxml' and RE_LXML_NESTING_TAGS.search(markup):
+    for tag in soup.find_all(('embed', 'keygen', 'source', 'track', 'wbr')):
+      for child in reversed(tag.contents):
+        tag.insert_after(child.extract())
+  if parser == 'html5lib' and not RE_TBODY.search(markup):
+    for tag in soup.find_all('tbody'):
+      tag.unwrap()
+  if fragment and parser != 'html.parser' and soup.html is not None:
+    children = []
+    for wrapper in (soup.head, soup.body):
+      if wrapper is not None:
+        children.extend(wrapper.contents)
+    soup.html.extract()
+    for child in children:
+      soup.append(child.extract())
+  return soup
+
+
 def RenderTemplate(template_name, template_values=None):
   template_values = template_values or {}
   tpl = template.loader.get_template(template_name)
@@ -178,8 +422,42 @@ def RenderTemplate(template_name, template_values=None):
 
 def RequestsCacheSession():
   return requests_cache.CachedSession(
-      str(settings.DB_DIR / 'requests_cache'), extension='.db',
-      expire_after=datetime.timedelta(days=2))
+      backend=response_cache.Backend(),
+      expire_after=datetime.timedelta(seconds=settings.RESPONSE_CACHE_SECONDS),
+      key_fn=_CacheKey)
+
+
+def _CacheKey(request, **kwargs):
+  """The cache key of a request, whether looked up, or saved by `Fetch()`.
+
+  Without TLS `verify`, which lookups get from the environment (e.g.
+  REQUESTS_CA_BUNDLE), but `save_response()` doesn't.
+  """
+  kwargs.pop('verify', None)
+  return requests_cache.create_key(request, **kwargs)
+
+
+def _IsCacheable(response):
+  """Whether to cache a response, once its whole body has been read."""
+  return (response.status_code == 200
+          and IsTextContentType(response.headers.get('content-type')))
+
+
+def NodePath(tag):
+  """Describe where a node is in its tree, e.g. '/html[0]/body[0]/div[2]'.
+
+  Each step's index counts only preceding siblings of the same name.
+  """
+  if not isinstance(tag, bs4.Tag):
+    return '#text'
+  parts = []
+  while tag.parent is not None:
+    index = sum(
+        1 for sibling in tag.previous_siblings
+        if getattr(sibling, 'name', None) == tag.name)
+    parts.append('%s[%d]' % (tag.name, index))
+    tag = tag.parent
+  return '/' + '/'.join(reversed(parts))
 
 
 def SoupTagOnly(tag):
@@ -191,6 +469,9 @@ def Strip(tag, reason=None):
     tag['style'] = 'outline: 2px dotted red'
     if reason: tag['strip_reason'] = reason
   else:
+    index = _SCORE_INDEX.get()
+    if index is not None:
+      index.Strip(tag)
     tag.extract()
 
 